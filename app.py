@@ -1,13 +1,31 @@
+import calendar
 import csv
+import hashlib
+import json
 import os
 import re
-from datetime import datetime
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from functools import wraps
 from io import StringIO
 
-from flask import Flask, flash, redirect, render_template, request, url_for
+import click
+from flask import Flask, Response, abort, flash, jsonify, redirect, render_template, request, stream_with_context, url_for
+from jinja2 import FileSystemBytecodeCache
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
+from sqlalchemy import and_, bindparam, case, event, func, inspect, literal, or_, select
+from sqlalchemy.dialects.postgresql import insert as insert_postgres
+from sqlalchemy.dialects.sqlite import insert as insert_sqlite
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex
 from werkzeug.security import check_password_hash, generate_password_hash
-from models import Product, Transaction, User, db
+from armazenamento import ArmazenamentoLocal, ArmazenamentoSupabase, chave_conteudo
+from eventos import CANAL_RESGATES, barramento, conexoes_sse, iniciar_ouvinte_postgres
+from exportacao import gerar_csv, gerar_xlsx
+from models import STATUS_TRANSACAO, Notificacao, Product, ResumoDiario, ResumoPendente, Transaction, User, db
+from notificacoes import CanalEmail, CanalLog, CanalWebhook, enfileirar_notificacao, executar_worker
+from perfil import instalar_perfil, ler_server_timing
 from supabase import create_client
 
 # --- Inicialização do Cliente Supabase ---
@@ -20,7 +38,43 @@ app = Flask(__name__)
 app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-secret-key")
+# Relatórios: tempo de cache (segundos) e uso da tabela de resumo diário
+app.config["RELATORIO_CACHE_TTL"] = int(os.getenv("RELATORIO_CACHE_TTL", "60"))
+app.config["RELATORIO_USAR_RESUMO"] = os.getenv("RELATORIO_USAR_RESUMO", "0") == "1"
+# Tempo máximo (segundos) de cada conexão SSE; o navegador reconecta sozinho
+app.config["SSE_DURACAO"] = int(os.getenv("SSE_DURACAO", "300"))
+# Conexões SSE simultâneas por processo: cada uma prende uma thread do gunicorn,
+# então deve ficar bem abaixo de --threads (ver Dockerfile)
+app.config["SSE_MAX_CONEXOES"] = int(os.getenv("SSE_MAX_CONEXOES", "2"))
+# Validade dos pontos (regulamento, item 4.1) e antecedência do aviso de expiração
+app.config["PONTOS_VALIDADE_MESES"] = int(os.getenv("PONTOS_VALIDADE_MESES", "24"))
+app.config["PONTOS_AVISO_DIAS"] = int(os.getenv("PONTOS_AVISO_DIAS", "30"))
+# Onde ficam as imagens dos prêmios: "supabase" (bucket) ou "local" (static/uploads)
+app.config["ARMAZENAMENTO_IMAGENS"] = os.getenv("ARMAZENAMENTO_IMAGENS", "supabase")
+# Canal do worker de notificações: "log" (terminal), "webhook" (gateway WhatsApp/SMS) ou "email"
+app.config["NOTIFICACOES_CANAL"] = os.getenv("NOTIFICACOES_CANAL", "log")
+# Tempo de SQL e de render (por template e bloco) no header Server-Timing de cada resposta
+app.config["PERFIL_TEMPLATES"] = os.getenv("PERFIL_TEMPLATES", "0") == "1"
+# Com o perfil ligado, registra no log as requisições acima deste tempo (ms)
+app.config["PERFIL_LOG_MS"] = int(os.getenv("PERFIL_LOG_MS", "500"))
+# Bytecode dos templates compilados, compartilhado pelos workers ("" desliga)
+app.config["JINJA_CACHE_DIR"] = os.getenv("JINJA_CACHE_DIR", os.path.join(app.instance_path, "jinja_cache"))
 db.init_app(app)
+instalar_perfil(app)
+
+if app.config["JINJA_CACHE_DIR"]:
+    try:
+        os.makedirs(app.config["JINJA_CACHE_DIR"], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config["JINJA_CACHE_DIR"])
+    except OSError as e:
+        print(f"Cache de templates desativado: {e}")
+
+def armazenamento_por_nome(nome: str):
+    if nome == "local":
+        return ArmazenamentoLocal(app.static_folder)
+    return ArmazenamentoSupabase(supabase, bucket_name)
+
+armazenamento = armazenamento_por_nome(app.config["ARMAZENAMENTO_IMAGENS"])
 
 ## --- Configuração do Flask-Login ---
 login_manager = LoginManager()
@@ -47,6 +101,16 @@ def only_digits(s: str | None) -> str:
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+def buscar_usuario_login(identificador: str) -> User | None:
+    """Busca por telefone normalizado (apenas dígitos) ou por email."""
+    telefone_limpo = only_digits(identificador)
+    user = None
+    if telefone_limpo:
+        user = User.query.filter_by(telefone=telefone_limpo).first()
+    if not user:
+        user = User.query.filter_by(email=identificador.lower()).first()
+    return user
+
 # --- Rotas de Autenticação ---
 
 @app.route("/login", methods=["GET", "POST"])
@@ -57,16 +121,7 @@ def login():
     if request.method == "POST":
         identificador = (request.form.get("telefone") or "").strip()
         senha = request.form.get("senha") or ""
-        
-        # Limpa o telefone para bater com o padrão salvo (apenas dígitos)
-        telefone_limpo = only_digits(identificador)
-
-        # Busca por telefone normalizado ou por email
-        user = None
-        if telefone_limpo:
-            user = User.query.filter_by(telefone=telefone_limpo).first()
-        if not user:
-            user = User.query.filter_by(email=identificador.lower()).first()
+        user = buscar_usuario_login(identificador)
 
         # Validação simples (comparação direta para senhas legíveis ou hash se preferir)
         if user and user.senha_hash == senha:
@@ -212,7 +267,9 @@ def admin_deletar_usuario(id):
     try:
         # Forçamos a deleção de todas as transações vinculadas primeiro
         # Isso evita que o SQLAlchemy tente apenas "desvincular" (setar NULL) os registros
+        marcar_resumo_pendente(Transaction.user_id == u.id)
         Transaction.query.filter_by(user_id=u.id).delete()
+        Notificacao.query.filter_by(user_id=u.id).delete()
         
         # Agora removemos o usuário
         db.session.delete(u)
@@ -246,7 +303,6 @@ def admin_editar_transacao(id):
         return redirect(url_for("index"))
     
     t = Transaction.query.get_or_404(id)
-    user = User.query.get(t.user_id)
     
     novo_valor = parse_int(request.form.get("pontos"), 0)
     nova_descricao = request.form.get("descricao")
@@ -255,9 +311,17 @@ def admin_editar_transacao(id):
     # Se era 100 e mudei para 120, a diferença é +20
     diferenca = novo_valor - t.pontos
     
-    t.pontos = novo_valor
-    t.descricao = nova_descricao
-    user.saldo_total += diferenca
+    # Condicional no valor lido: duas edições simultâneas não aplicam a diferença duas vezes
+    if not Transaction.query.filter_by(id=t.id, pontos=t.pontos).update(
+        {Transaction.pontos: novo_valor, Transaction.descricao: nova_descricao}, synchronize_session=False
+    ):
+        db.session.rollback()
+        flash("O lançamento foi alterado por outra pessoa. Confira e tente de novo.", "warning")
+        return redirect(url_for("admin_usuarios"))
+    # Soma no próprio UPDATE: não sobrescreve resgates e estornos gravados ao mesmo tempo
+    User.query.filter_by(id=t.user_id).update(
+        {User.saldo_total: User.saldo_total + diferenca}, synchronize_session=False
+    )
     
     db.session.commit()
     flash("Lançamento atualizado com sucesso!", "success")
@@ -271,14 +335,12 @@ def admin_premios():
     if request.method == "POST":
         file = request.files.get("imagem_file")
         if file and allowed_file(file.filename):
-            filename = f"{datetime.now().timestamp()}_{file.filename}"
-            filepath = f"public/{filename}"
-            supabase.storage.from_(bucket_name).upload(filepath, file.read())
-            imagem_url = supabase.storage.from_(bucket_name).get_public_url(filepath)
+            imagem_url = salvar_imagem(file)
             novo = Product(
                 nome=request.form.get("nome"),
                 descricao=request.form.get("descricao"),
                 valor_pontos=parse_int(request.form.get("valor_pontos"), 0),
+                estoque=parse_estoque(request.form.get("estoque")),
                 categoria="Geral", # Define um valor padrão interno
                 imagem_url=imagem_url
             )
@@ -298,14 +360,12 @@ def editar_produto(id):
     produto.nome = request.form.get("nome")
     produto.descricao = request.form.get("descricao")
     produto.valor_pontos = parse_int(request.form.get("valor_pontos"), 0)
+    produto.estoque = parse_estoque(request.form.get("estoque"))
     # Categoria removida do formulário
 
     file = request.files.get("imagem_file")
     if file and allowed_file(file.filename):
-        filename = f"{datetime.now().timestamp()}_{file.filename}"
-        filepath = f"public/{filename}"
-        supabase.storage.from_(bucket_name).upload(filepath, file.read())
-        produto.imagem_url = supabase.storage.from_(bucket_name).get_public_url(filepath)
+        produto.imagem_url = salvar_imagem(file)
 
     db.session.commit()
     flash(f"Prêmio '{produto.nome}' atualizado!", "success")
@@ -318,6 +378,8 @@ def editar_produto(id):
 def excluir_produto(id):
     if current_user.role != 'admin': return redirect(url_for("index"))
     produto = Product.query.get_or_404(id)
+    # Mantém o histórico de resgates (descrição) e apenas desfaz o vínculo
+    Transaction.query.filter_by(product_id=produto.id).update({Transaction.product_id: None}, synchronize_session=False)
     db.session.delete(produto)
     db.session.commit()
     flash("Produto removido!", "warning")
@@ -336,6 +398,103 @@ def ativar_usuario(id):
     flash(f"Pintor {u.nome} ativado!", "success")
     return redirect(url_for("admin_usuarios"))
 
+@app.route("/admin/usuarios/ativar-lote", methods=["POST"])
+@login_required
+def ativar_usuarios_lote():
+    if current_user.role != 'admin': return redirect(url_for("index"))
+    ids = [i for i in (parse_int(valor, 0) for valor in request.form.getlist("user_ids")) if i]
+    ativados = 0
+    if ids:
+        # Um único UPDATE para toda a seleção
+        ativados = User.query.filter(User.id.in_(ids), User.role == 'pintor', User.ativo == False).update(
+            {User.ativo: True}, synchronize_session=False
+        )
+        db.session.commit()
+    flash(f"{ativados} pintor(es) ativado(s)!", "success")
+    return redirect(url_for("admin_usuarios"))
+
+# Limites das colunas de user_tintas: valor maior vai para os inválidos da linha, em vez
+# de derrubar o INSERT do lote inteiro (DataError no Postgres)
+TAMANHOS_IMPORTACAO = {
+    campo: User.__table__.c[campo].type.length for campo in ("nome", "telefone", "email", "cpf_cnpj", "senha_hash")
+}
+
+@app.route("/admin/usuarios/importar", methods=["POST"])
+@login_required
+def importar_usuarios():
+    """Cadastro em lote via CSV (nome, telefone, cpf_cnpj, email e senha opcional)."""
+    if current_user.role != 'admin': return redirect(url_for("index"))
+    arquivo = request.files.get("arquivo_csv")
+    if not arquivo or not arquivo.filename:
+        flash("Selecione um arquivo CSV.", "error")
+        return redirect(url_for("admin_usuarios"))
+
+    conteudo = arquivo.read().decode("utf-8-sig", errors="replace")
+    # Aceita vírgula ou ponto e vírgula (CSV salvo pelo Excel em português)
+    delimitador = ";" if conteudo.split("\n", 1)[0].count(";") > conteudo.split("\n", 1)[0].count(",") else ","
+    leitor = csv.DictReader(StringIO(conteudo), delimiter=delimitador)
+    leitor.fieldnames = [(campo or "").strip().lower() for campo in (leitor.fieldnames or [])]
+    if not {"nome", "telefone"} <= set(leitor.fieldnames):
+        flash("O CSV precisa das colunas nome e telefone.", "error")
+        return redirect(url_for("admin_usuarios"))
+
+    ativo = request.form.get("ativar") == "1"
+    novos, invalidos, repetidos = [], [], []
+    vistos = {"telefone": set(), "email": set(), "cpf_cnpj": set()}
+    for numero, linha in enumerate(leitor, start=2):
+        registro = {
+            "nome": (linha.get("nome") or "").strip(),
+            "telefone": only_digits(linha.get("telefone")),
+            "email": (linha.get("email") or "").strip().lower() or None,
+            "cpf_cnpj": (linha.get("cpf_cnpj") or "").strip() or None,
+            "senha_hash": (linha.get("senha") or "").strip() or None,
+        }
+        if not registro["nome"] or len(registro["telefone"]) < 10 or any(
+            registro[campo] and len(registro[campo]) > tamanho for campo, tamanho in TAMANHOS_IMPORTACAO.items()
+        ):
+            invalidos.append(numero)
+            continue
+        # Repetidos dentro do próprio arquivo
+        if any(registro[campo] and registro[campo] in vistos[campo] for campo in vistos):
+            repetidos.append(numero)
+            continue
+        for campo in vistos:
+            if registro[campo]:
+                vistos[campo].add(registro[campo])
+        novos.append((numero, registro))
+
+    # Uma consulta por lote para saber o que já existe no banco
+    existentes = {campo: set() for campo in vistos}
+    for inicio in range(0, len(novos), 500):
+        lote = [registro for _, registro in novos[inicio:inicio + 500]]
+        condicoes = [
+            getattr(User, campo).in_(valores)
+            for campo in vistos
+            if (valores := [registro[campo] for registro in lote if registro[campo]])
+        ]
+        for telefone, email, cpf_cnpj in db.session.query(User.telefone, User.email, User.cpf_cnpj).filter(or_(*condicoes)):
+            existentes["telefone"].add(telefone)
+            existentes["email"].add(email)
+            existentes["cpf_cnpj"].add(cpf_cnpj)
+
+    linhas = []
+    for numero, registro in novos:
+        if any(registro[campo] and registro[campo] in existentes[campo] for campo in existentes):
+            repetidos.append(numero)
+        else:
+            linhas.append({**registro, "role": 'pintor', "ativo": ativo, "saldo_total": 0})
+    for inicio in range(0, len(linhas), 500):
+        db.session.execute(User.__table__.insert(), linhas[inicio:inicio + 500])
+    db.session.commit()
+
+    flash(f"{len(linhas)} pintor(es) importado(s){' e ativado(s)' if ativo else ''}.", "success")
+    repetidos.sort()
+    if repetidos:
+        flash(f"{len(repetidos)} linha(s) ignorada(s) por telefone, e-mail ou CPF/CNPJ já cadastrado: {', '.join(map(str, repetidos[:20]))}{'...' if len(repetidos) > 20 else ''}", "warning")
+    if invalidos:
+        flash(f"{len(invalidos)} linha(s) sem nome ou telefone válido ou com campo longo demais: {', '.join(map(str, invalidos[:20]))}{'...' if len(invalidos) > 20 else ''}", "error")
+    return redirect(url_for("admin_usuarios"))
+
 @app.route("/resgatar/<int:produto_id>", methods=["POST"])
 @login_required
 def resgatar_produto(produto_id):
@@ -344,13 +503,13 @@ def resgatar_produto(produto_id):
     if current_user.saldo_total < produto.valor_pontos:
         flash("Saldo insuficiente.", "error")
         return redirect(url_for("catalogo"))
-    transacao = Transaction(
-        user_id=current_user.id, pontos=-produto.valor_pontos,
-        descricao=f"Resgate: {produto.nome}", status='pendente'
-    )
-    current_user.saldo_total -= produto.valor_pontos
-    db.session.add(transacao)
-    db.session.commit()
+    erro = reservar_resgate(current_user, produto)
+    if erro == "estoque":
+        flash("Prêmio esgotado.", "error")
+        return redirect(url_for("catalogo"))
+    if erro == "saldo":
+        flash("Saldo insuficiente.", "error")
+        return redirect(url_for("catalogo"))
     flash("Solicitação de resgate enviada!", "success")
     return redirect(url_for("extrato"))
 
@@ -359,12 +518,28 @@ def resgatar_produto(produto_id):
 def admin_aprovar_resgate(id, acao):
     if current_user.role != 'admin': return redirect(url_for("index"))
     t = Transaction.query.get_or_404(id)
+    novo_status = {"confirmar": 'concluido', "reprovar": 'reprovado'}.get(acao)
+    # Transição condicional: só um clique (ou admin) processa o mesmo pedido
+    if not novo_status or not Transaction.query.filter_by(id=t.id, status='pendente').update(
+        {Transaction.status: novo_status}, synchronize_session=False
+    ):
+        db.session.rollback()
+        flash("Este pedido já foi processado.", "warning")
+        return redirect(url_for("admin_usuarios"))
+    publicar_evento("resgate_status", id=t.id, status=novo_status)
     user = User.query.get(t.user_id)
-    if acao == "confirmar":
-        t.status = 'concluido'
-    elif acao == "reprovar":
-        user.saldo_total += abs(t.pontos)
-        t.status = 'reprovado'
+    if novo_status == 'concluido':
+        enfileirar_notificacao(user, "resgate_aprovado", f"Seu resgate foi aprovado ({t.descricao}). O prêmio já pode ser retirado na loja Novo Mundo das Tintas.")
+    if novo_status == 'reprovado':
+        enfileirar_notificacao(user, "resgate_reprovado", f"Seu resgate não foi aprovado ({t.descricao}). Os {abs(t.pontos)} pontos voltaram para o seu saldo.")
+        # Devolve a unidade reservada e os pontos (mesma ordem de bloqueio do resgate)
+        if t.product_id:
+            Product.query.filter(Product.id == t.product_id, Product.estoque.isnot(None)).update(
+                {Product.estoque: Product.estoque + 1}, synchronize_session=False
+            )
+        User.query.filter_by(id=t.user_id).update(
+            {User.saldo_total: User.saldo_total + abs(t.pontos)}, synchronize_session=False
+        )
     db.session.commit()
     return redirect(url_for("admin_usuarios"))
 
@@ -373,11 +548,394 @@ def admin_aprovar_resgate(id, acao):
 def admin_confirmar_entrega(id):
     if current_user.role != 'admin': return redirect(url_for("index"))
     t = Transaction.query.get_or_404(id)
-    t.status = 'entregue'
+    # Só um resgate aprovado pode ser entregue, e uma vez: clique duplo ou aba
+    # desatualizada não reenviam o aviso nem entregam um resgate reprovado
+    if not Transaction.query.filter_by(id=t.id, status='concluido').update(
+        {Transaction.status: 'entregue'}, synchronize_session=False
+    ):
+        db.session.rollback()
+        flash("Este resgate não está aguardando retirada.", "warning")
+        return redirect(url_for("admin_usuarios"))
+    publicar_evento("resgate_status", id=t.id, status='entregue')
+    enfileirar_notificacao(User.query.get(t.user_id), "resgate_entregue", f"Entrega confirmada: {t.descricao}. Obrigado por participar do Clube Novo Mundo!")
     db.session.commit()
     flash("Entrega confirmada!", "success")
     return redirect(url_for("admin_usuarios"))
 
+@app.route("/admin/eventos")
+@login_required
+def admin_eventos():
+    """Stream SSE com novos resgates e mudanças de status para o painel admin."""
+    if current_user.role != 'admin':
+        return jsonify({"erro": "Acesso restrito."}), 403
+    if usa_postgres():
+        iniciar_ouvinte_postgres(db.engine)
+
+    # Reconexão no mesmo worker continua de onde parou; em outro worker começa do agora
+    ultimo = barramento.ultimo
+    processo, _, seq = (request.headers.get("Last-Event-ID") or "").partition("-")
+    if processo == ID_PROCESSO:
+        ultimo = min(parse_int(seq, ultimo), barramento.ultimo)
+    duracao = app.config["SSE_DURACAO"]
+    maximo = app.config["SSE_MAX_CONEXOES"]
+
+    def transmitir(ultimo):
+        # A vaga é ocupada só quando o stream começa: se o cliente desistir antes,
+        # o gerador nunca roda e não há vaga a devolver
+        if not conexoes_sse.entrar(maximo):
+            # Worker lotado: libera a thread e pede ao navegador para tentar mais tarde
+            yield "retry: 30000\n: limite de conexoes atingido\n\n"
+            return
+        try:
+            fim = time.monotonic() + duracao
+            yield "retry: 3000\n\n"
+            while time.monotonic() < fim:
+                eventos = barramento.aguardar(ultimo, timeout=15)
+                if not eventos:
+                    yield ": ping\n\n"
+                    continue
+                for seq, evento in eventos:
+                    ultimo = seq
+                    yield f"id: {ID_PROCESSO}-{seq}\nevent: {evento['tipo']}\ndata: {json.dumps(evento)}\n\n"
+        finally:
+            conexoes_sse.sair()
+
+    return Response(transmitir(ultimo), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- Relatórios ---
+
+@app.route("/admin/relatorios")
+@login_required
+def admin_relatorios():
+    if current_user.role != 'admin': return redirect(url_for("index"))
+    periodo = request.args.get("periodo", "dia")
+    dias = parse_int(request.args.get("dias"), 90)
+    return render_template("admin_relatorios.html", relatorio=montar_relatorio(periodo, dias))
+
+@app.route("/admin/relatorios.json")
+@login_required
+def admin_relatorios_json():
+    if current_user.role != 'admin':
+        return jsonify({"erro": "Acesso restrito."}), 403
+    periodo = request.args.get("periodo", "dia")
+    dias = parse_int(request.args.get("dias"), 90)
+    return jsonify(montar_relatorio(periodo, dias))
+
+# Folga na busca por lançamentos alterados: cobre gravações com atualizado_em
+# anterior ao início da consolidação, mas commitadas depois dele
+FOLGA_RESUMO = timedelta(hours=1)
+
+@app.cli.command("consolidar-resumo")
+@click.option("--dias", default=2, show_default=True, help="Quantos dias fechados recalcular sempre.")
+def consolidar_resumo(dias):
+    """Recalcula o resumo diário (agendar no cron toda noite).
+
+    Além dos últimos `--dias`, refaz todo dia fechado com lançamento criado ou
+    alterado desde a consolidação anterior (resgate reprovado dias depois, ajuste
+    do admin) e os dias anotados em resumo_pendente_tintas (lançamentos apagados).
+    Dias recalculados que ficaram sem lançamentos saem do resumo.
+    """
+    execucao = datetime.utcnow()
+    hoje = execucao.date()
+    inicio = hoje - timedelta(days=max(dias, 1))
+    alvo = {inicio + timedelta(days=i) for i in range((hoje - inicio).days)}
+
+    ultima = db.session.query(func.max(ResumoDiario.atualizado_em)).scalar()
+    if ultima is not None:
+        alterados = db.session.query(expr_periodo(Transaction.data, "dia")).filter(
+            Transaction.atualizado_em >= ultima - FOLGA_RESUMO,
+            Transaction.data < datetime.combine(hoje, datetime.min.time()),
+        ).distinct()
+        alvo |= {date.fromisoformat(dia) for (dia,) in alterados}
+    alvo |= {dia for (dia,) in db.session.query(ResumoPendente.dia).filter(ResumoPendente.dia < hoje)}
+
+    gravados = removidos = 0
+    for primeiro, ultimo in faixas_de_dias(alvo):
+        linhas = serie_extrato(
+            "dia", datetime.combine(primeiro, datetime.min.time()),
+            ate=datetime.combine(ultimo + timedelta(days=1), datetime.min.time()),
+        )
+        for chave, valores in linhas.items():
+            db.session.merge(ResumoDiario(dia=date.fromisoformat(chave), atualizado_em=execucao, **valores))
+        com_dados = [date.fromisoformat(chave) for chave in linhas]
+        removidos += ResumoDiario.query.filter(
+            ResumoDiario.dia.between(primeiro, ultimo), ResumoDiario.dia.notin_(com_dados),
+        ).delete(synchronize_session=False)
+        gravados += len(linhas)
+    # Marcações feitas durante a consolidação ficam para a próxima execução
+    ResumoPendente.query.filter(ResumoPendente.dia < hoje, ResumoPendente.marcado_em < execucao).delete(synchronize_session=False)
+    db.session.commit()
+    click.echo(f"Resumo diário consolidado: {len(alvo)} dia(s) recalculado(s), {gravados} gravado(s), {removidos} removido(s) sem lançamentos.")
+
+# --- Exportações ---
+
+FORMATOS_EXPORTACAO = {
+    "csv": (gerar_csv, "text/csv; charset=utf-8"),
+    "xlsx": (gerar_xlsx, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+@app.route("/admin/exportar/pintores.<formato>")
+@login_required
+def exportar_pintores(formato):
+    """Pintores com saldo e totais ganhos/resgatados (filtros: de, ate, ativo)."""
+    if current_user.role != 'admin': return redirect(url_for("index"))
+    if formato not in FORMATOS_EXPORTACAO: abort(404)
+
+    filtros_extrato = filtros_periodo()
+    ganho = func.sum(case((and_(Transaction.pontos > 0, Transaction.status != 'reprovado'), Transaction.pontos), else_=0))
+    gasto = func.sum(case((_filtro_resgate_valido(), -Transaction.pontos), else_=0))
+    totais = db.session.query(
+        Transaction.user_id, ganho.label("ganho"), gasto.label("gasto")
+    ).filter(*filtros_extrato).group_by(Transaction.user_id).subquery()
+
+    query = db.session.query(
+        User.nome, User.telefone, User.cpf_cnpj, User.email, User.ativo,
+        func.coalesce(totais.c.ganho, 0), func.coalesce(totais.c.gasto, 0), User.saldo_total,
+    ).outerjoin(totais, totais.c.user_id == User.id).filter(User.role == 'pintor')
+    if request.args.get("ativo") in ("0", "1"):
+        query = query.filter(User.ativo == (request.args["ativo"] == "1"))
+    query = query.order_by(User.nome.asc()).execution_options(yield_per=2000)
+
+    cabecalho = ["Pintor", "Telefone", "CPF/CNPJ", "E-mail", "Ativo", "Acumulado", "Resgatado", "Saldo Atual"]
+    return resposta_exportacao(formato, "pintores", cabecalho, query)
+
+@app.route("/admin/exportar/extrato.<formato>")
+@login_required
+def exportar_extrato(formato):
+    """Lançamentos do extrato (filtros: de, ate, status, user_id)."""
+    if current_user.role != 'admin': return redirect(url_for("index"))
+    if formato not in FORMATOS_EXPORTACAO: abort(404)
+
+    query = db.session.query(
+        Transaction.id, Transaction.data, User.nome, User.telefone,
+        Transaction.descricao, Transaction.tipo, Transaction.status, Transaction.pontos,
+    ).join(User, User.id == Transaction.user_id).filter(*filtros_periodo())
+    if request.args.get("status") in STATUS_TRANSACAO:
+        query = query.filter(Transaction.status == request.args["status"])
+    if parse_int(request.args.get("user_id"), 0):
+        query = query.filter(Transaction.user_id == parse_int(request.args.get("user_id"), 0))
+    query = query.order_by(Transaction.data.asc(), Transaction.id.asc()).execution_options(yield_per=2000)
+
+    cabecalho = ["ID", "Data", "Pintor", "Telefone", "Descrição", "Tipo", "Status", "Pontos"]
+    return resposta_exportacao(formato, "extrato", cabecalho, query)
+
+# --- Rotinas de Manutenção ---
+
+@app.cli.command("conciliar-saldos")
+@click.option("--corrigir", is_flag=True, help="Grava em saldo_total o saldo recalculado.")
+@click.option("--lote", default=1000, show_default=True, help="Usuários por lote (um commit por lote).")
+@click.option("--exibir", default=50, show_default=True, help="Máximo de divergências listadas.")
+def conciliar_saldos(corrigir, lote, exibir):
+    """Confere saldo_total contra a soma do extrato de cada usuário."""
+    inicio = time.monotonic()
+    usuarios = transacoes = divergentes = corrigidos = 0
+    ultimo_id = 0
+    soma_extrato = (
+        select(Transaction.user_id, func.sum(Transaction.pontos).label("esperado"), func.count(Transaction.id).label("qtd"))
+        .where(Transaction.status != 'reprovado')
+        .group_by(Transaction.user_id)
+    )
+
+    while True:
+        # Lote por faixa de id (keyset): cada consulta e cada correção seguram pouco tempo
+        ids = [linha[0] for linha in db.session.query(User.id).filter(User.id > ultimo_id).order_by(User.id).limit(lote)]
+        if not ids:
+            break
+        faixa = soma_extrato.where(Transaction.user_id.between(ids[0], ids[-1])).subquery()
+        linhas = db.session.query(
+            User.id, User.nome, User.saldo_total, func.coalesce(faixa.c.esperado, 0), func.coalesce(faixa.c.qtd, 0),
+        ).outerjoin(faixa, faixa.c.user_id == User.id).filter(User.id.between(ids[0], ids[-1])).all()
+
+        diferentes = []
+        for user_id, nome, saldo, esperado, qtd in linhas:
+            usuarios += 1
+            transacoes += int(qtd)
+            if saldo != esperado:
+                diferentes.append(user_id)
+                if divergentes + len(diferentes) <= exibir:
+                    click.echo(f"#{user_id} {nome}: saldo_total={saldo} extrato={esperado} diferença={esperado - saldo:+d}")
+        divergentes += len(diferentes)
+
+        if corrigir and diferentes:
+            # Trava os divergentes antes de recalcular (em ordem de id, como o expirar-pontos).
+            # A soma roda num comando novo, que no READ COMMITTED já enxerga os resgates
+            # commitados enquanto esperávamos a trava; os seguintes esperam este commit.
+            saldos = dict(
+                db.session.query(User.id, User.saldo_total).filter(User.id.in_(diferentes))
+                .order_by(User.id).with_for_update()
+            )
+            esperados = dict(
+                db.session.query(Transaction.user_id, func.sum(Transaction.pontos))
+                .filter(Transaction.user_id.in_(diferentes), Transaction.status != 'reprovado')
+                .group_by(Transaction.user_id)
+            )
+            # Confere de novo com as linhas travadas: só grava quem ainda diverge
+            ajustes = [
+                {"b_id": user_id, "b_saldo": int(esperados.get(user_id) or 0)}
+                for user_id, saldo in saldos.items() if saldo != int(esperados.get(user_id) or 0)
+            ]
+            if ajustes:
+                db.session.execute(
+                    User.__table__.update().where(User.id == bindparam("b_id")).values(saldo_total=bindparam("b_saldo")),
+                    ajustes,
+                )
+            corrigidos += len(ajustes)
+        db.session.commit()
+        ultimo_id = ids[-1]
+
+    duracao = time.monotonic() - inicio
+    click.echo(
+        f"{usuarios} usuário(s) e {transacoes} lançamento(s) conferidos em {duracao:.2f}s "
+        f"({usuarios / duracao if duracao else 0:.0f} usuários/s, {transacoes / duracao if duracao else 0:.0f} lançamentos/s)."
+    )
+    if corrigir:
+        click.echo(f"{divergentes} divergência(s) encontrada(s), {corrigidos} saldo(s) corrigido(s).")
+    else:
+        click.echo(f"{divergentes} divergência(s) encontrada(s). Use --corrigir para ajustar.")
+
+@app.cli.command("expirar-pontos")
+@click.option("--lote", default=1000, show_default=True, help="Usuários por lote (um commit por lote).")
+@click.option("--a-partir-de", "a_partir_de", default=0, help="Retoma depois deste id de usuário.")
+@click.option("--data-base", default=None, help="Data de referência AAAA-MM-DD (padrão: hoje).")
+def expirar_pontos(lote, a_partir_de, data_base):
+    """Lança a expiração dos créditos vencidos (FIFO contra os resgates), em lotes.
+
+    Pode ser interrompido e rodado de novo: as expirações já lançadas contam como
+    débito no cálculo, então usuários já processados não expiram duas vezes.
+    """
+    agora = datetime.utcnow()
+    referencia = datetime.fromisoformat(data_base) if data_base else agora
+    corte = subtrair_meses(referencia, app.config["PONTOS_VALIDADE_MESES"])
+    descricao = f"Pontos expirados (créditos até {corte:%d/%m/%Y})"
+    inicio = time.monotonic()
+    usuarios = expirados = pontos = 0
+    ultimo_id = a_partir_de
+
+    while True:
+        # FOR UPDATE no lote: resgates desses usuários esperam o commit do lote
+        ids = [linha[0] for linha in db.session.query(User.id).filter(User.id > ultimo_id).order_by(User.id).limit(lote).with_for_update()]
+        if not ids:
+            break
+        vencidos = pontos_vencidos(corte).filter(Transaction.user_id.between(ids[0], ids[-1])).all()
+        if vencidos:
+            db.session.execute(Transaction.__table__.insert(), [
+                {"user_id": user_id, "pontos": -valor, "data": agora, "descricao": descricao, "status": 'aprovado', "tipo": 'expiracao'}
+                for user_id, valor in vencidos
+            ])
+            db.session.execute(
+                User.__table__.update().where(User.id == bindparam("b_id")).values(saldo_total=User.saldo_total - bindparam("b_valor")),
+                [{"b_id": user_id, "b_valor": valor} for user_id, valor in vencidos],
+            )
+        db.session.commit()
+        usuarios += len(ids)
+        expirados += len(vencidos)
+        pontos += sum(valor for _, valor in vencidos)
+        ultimo_id = ids[-1]
+        click.echo(f"... até o usuário #{ultimo_id}: {expirados} expiração(ões)")
+
+    duracao = time.monotonic() - inicio
+    click.echo(
+        f"{usuarios} usuário(s) processados em {duracao:.2f}s ({usuarios / duracao if duracao else 0:.0f} usuários/s); "
+        f"{expirados} com pontos expirados, total de {pontos} pontos (créditos até {corte:%d/%m/%Y})."
+    )
+
+@app.cli.command("limpar-imagens")
+@click.option("--executar", is_flag=True, help="Remove de fato (sem a opção, apenas lista).")
+@click.option("--idade-minima", default=24, show_default=True, help="Ignora objetos com menos de N horas.")
+@click.option("--armazenamento", "nome", type=click.Choice(["supabase", "local"]), default=None,
+              help="Armazenamento a limpar (padrão: ARMAZENAMENTO_IMAGENS).")
+def limpar_imagens(executar, idade_minima, nome):
+    """Remove imagens que nenhum prêmio referencia (trocadas, excluídas ou enviadas em dobro)."""
+    alvo = armazenamento_por_nome(nome) if nome else armazenamento
+
+    def em_uso() -> set[str]:
+        db.session.rollback()  # descarta o snapshot anterior e lê os prêmios de agora
+        return {alvo.caminho_da_url(url) for (url,) in db.session.query(Product.imagem_url)}
+
+    # Margem para não apagar um envio cujo prêmio ainda não foi gravado; o reenvio
+    # de uma imagem já existente renova a data do objeto (ver salvar_imagem)
+    limite = datetime.now(timezone.utc) - timedelta(hours=idade_minima)
+    usadas = em_uso()
+    orfaos = [caminho for caminho, alterado_em in alvo.listar() if caminho not in usadas and alterado_em < limite]
+    for caminho in orfaos:
+        click.echo(caminho)
+    if executar and orfaos:
+        removidas = 0
+        for inicio in range(0, len(orfaos), 100):
+            # Confere de novo logo antes de apagar: um prêmio pode ter voltado a usar
+            # a imagem (mesmo hash) enquanto a listagem rodava
+            usadas = em_uso()
+            lote = [caminho for caminho in orfaos[inicio:inicio + 100] if caminho not in usadas]
+            alvo.remover(lote)
+            removidas += len(lote)
+        click.echo(f"{removidas} imagem(ns) removida(s).")
+    else:
+        click.echo(f"{len(orfaos)} imagem(ns) sem uso. Use --executar para remover.")
+
+@app.cli.command("enviar-notificacoes")
+@click.option("--lote", default=100, show_default=True, help="Notificações por lote (um commit por lote).")
+@click.option("--continuo", is_flag=True, help="Fica rodando e consulta a fila a cada --intervalo segundos.")
+@click.option("--intervalo", default=5.0, show_default=True)
+@click.option("--max-tentativas", default=5, show_default=True)
+@click.option("--espera-base", default=30, show_default=True, help="Segundos até a 1ª nova tentativa (dobra a cada falha).")
+@click.option("--concessao", default=1800, show_default=True,
+              help="Segundos que um lote reservado fica com o worker antes de voltar à fila (deve cobrir o lote inteiro).")
+def enviar_notificacoes(lote, continuo, intervalo, max_tentativas, espera_base, concessao):
+    """Worker da outbox: envia as notificações pendentes pelo canal configurado."""
+    executar_worker(canal_notificacoes(), lote, continuo, intervalo, max_tentativas, espera_base, concessao, log=click.echo)
+
+PAGINAS_ADMIN = ["/admin/usuarios", "/admin/premios", "/admin/relatorios", "/catalogo"]
+PAGINAS_PINTOR = ["/", "/extrato", "/catalogo", "/regulamento"]
+
+@app.cli.command("medir-paginas")
+@click.option("--repeticoes", default=10, show_default=True, help="Requisições por página (a 1ª é exibida à parte).")
+@click.option("--admin", "admin_id", type=int, default=None, help="Id do admin usado nas páginas administrativas.")
+@click.option("--pintor", "pintor_id", type=int, default=None, help="Id do pintor usado nas páginas do pintor.")
+@click.option("--blocos", is_flag=True, help="Lista também o tempo de cada template e bloco.")
+def medir_paginas(repeticoes, admin_id, pintor_id, blocos):
+    """Mede as páginas principais separando o tempo de SQL do tempo de render."""
+    app.config["PERFIL_TEMPLATES"] = True
+    app.config["PERFIL_LOG_MS"] = None
+    admin = db.session.get(User, admin_id) if admin_id else User.query.filter_by(role='admin').first()
+    pintor = db.session.get(User, pintor_id) if pintor_id else User.query.filter_by(role='pintor', ativo=True).first()
+
+    click.echo(f"{'página':<22}{'usuário':>9}{'1ª total':>10}{'total':>9}{'sql':>9}{'consultas':>11}{'render':>9}{'sql no render':>15}")
+    for user, paginas in ((admin, PAGINAS_ADMIN), (pintor, PAGINAS_PINTOR)):
+        if user is None:
+            continue
+        cliente = app.test_client()
+        with cliente.session_transaction() as sessao:
+            sessao["_user_id"] = str(user.id)
+            sessao["_fresh"] = True
+        for pagina in paginas:
+            medicoes = []
+            for _ in range(repeticoes):
+                # App context próprio: senão a requisição reaproveita o `g` da CLI (e o usuário em cache do Flask-Login)
+                with app.app_context():
+                    resposta = cliente.get(pagina)
+                if resposta.status_code != 200:
+                    break
+                medicoes.append(ler_server_timing(resposta.headers.get("Server-Timing", "")))
+            if not medicoes:
+                click.echo(f"{pagina:<22}{'#' + str(user.id):>9}  HTTP {resposta.status_code}")
+                continue
+            # Medianas sem a 1ª requisição (que inclui compilar/carregar os templates)
+            quentes = [tempos for tempos, _ in medicoes[1:]] or [medicoes[0][0]]
+            consultas = medicoes[-1][1].get("sql", "").split(" ")[0]
+            def mediana(chave):
+                valores = sorted(tempos.get(chave, 0.0) for tempos in quentes)
+                return valores[len(valores) // 2]
+            click.echo(
+                f"{pagina:<22}{'#' + str(user.id):>9}{medicoes[0][0]['total']:>8.1f}ms{mediana('total'):>7.1f}ms"
+                f"{mediana('sql'):>7.1f}ms{consultas:>11}"
+                f"{mediana('render'):>7.1f}ms{mediana('sql-render'):>13.1f}ms"
+            )
+            if blocos:
+                for chave in quentes[0]:
+                    if chave.startswith(("tpl-", "bloco-")):
+                        click.echo(f"    {chave:<40}{mediana(chave):>8.1f}ms")
+
 # --- Rotas Principais ---
 
 @app.route("/")
@@ -394,11 +952,14 @@ def index():
 
     # Removido o .limit(10) para mostrar o histórico completo
     transacoes = Transaction.query.filter_by(user_id=current_user.id).order_by(Transaction.data.desc()).all()
+    a_expirar, expiram_ate = pontos_a_expirar(current_user.id)
     
     return render_template("index.html", 
                            user=current_user, 
                            transacoes=transacoes, 
-                           competidores_acima=posicao_superior)
+                           competidores_acima=posicao_superior,
+                           pontos_a_expirar=a_expirar,
+                           expiram_ate=expiram_ate)
 
 
 @app.route("/catalogo")
@@ -419,12 +980,460 @@ def extrato():
 def regulamento():
     return render_template("regulamento.html")
 
+# --- API v1 (aplicativo) ---
+
+API_CAMPOS_TRANSACAO = ("id", "data", "descricao", "pontos", "tipo", "status", "product_id")
+API_CAMPOS_PRODUTO = ("id", "nome", "descricao", "valor_pontos", "imagem_url", "estoque", "disponivel")
+
+def api_login_required(view):
+    """Como login_required, mas responde 401 em JSON em vez de redirecionar."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify({"erro": "Autenticação necessária."}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route("/api/v1/login", methods=["POST"])
+def api_login():
+    dados = request.get_json(silent=True) or {}
+    user = buscar_usuario_login(str(dados.get("telefone") or "").strip())
+    if not user or user.senha_hash != (dados.get("senha") or ""):
+        return jsonify({"erro": "Credenciais inválidas."}), 401
+    if not user.ativo and user.role != 'admin':
+        return jsonify({"erro": "Aguarde a ativação da sua conta."}), 403
+    login_user(user, remember=True)
+    return jsonify({"id": user.id, "nome": user.nome, "role": user.role})
+
+@app.route("/api/v1/logout", methods=["POST"])
+@api_login_required
+def api_logout():
+    logout_user()
+    return jsonify({"ok": True})
+
+@app.route("/api/v1/saldo")
+@api_login_required
+def api_saldo():
+    acima = User.query.filter(
+        User.role == 'pintor',
+        User.ativo == True,
+        User.saldo_total > current_user.saldo_total
+    ).count()
+
+    def gerar():
+        a_expirar, expiram_ate = pontos_a_expirar(current_user.id)
+        return {
+            "saldo_total": current_user.saldo_total,
+            "posicao": acima + 1,
+            "competidores_acima": acima,
+            "pontos_a_expirar": a_expirar,
+            "expiram_ate": expiram_ate.date().isoformat(),
+        }
+
+    # O aviso de expiração depende do dia, por isso a data entra na versão
+    versao = ("saldo", current_user.id, current_user.saldo_total, current_user.atualizado_em, acima, datetime.utcnow().date())
+    return resposta_api(versao, gerar)
+
+@app.route("/api/v1/transacoes")
+@api_login_required
+def api_transacoes():
+    """Extrato paginado por cursor: ?limite=20&antes_de=<id>&campos=id,pontos,..."""
+    campos = campos_api(API_CAMPOS_TRANSACAO)
+    limite = min(max(parse_int(request.args.get("limite"), 20), 1), 100)
+    antes_de = parse_int(request.args.get("antes_de"), 0)
+    versao_extrato = db.session.query(
+        func.count(Transaction.id), func.max(Transaction.id), func.max(Transaction.atualizado_em)
+    ).filter(Transaction.user_id == current_user.id).one()
+
+    def gerar():
+        query = Transaction.query.filter_by(user_id=current_user.id)
+        if antes_de:
+            query = query.filter(Transaction.id < antes_de)
+        itens = query.order_by(Transaction.id.desc()).limit(limite + 1).all()
+        return {
+            "itens": [selecionar_campos(serializar_transacao(t), campos) for t in itens[:limite]],
+            "proximo": itens[limite - 1].id if len(itens) > limite else None,
+        }
+
+    return resposta_api(("transacoes", current_user.id, *versao_extrato, campos, limite, antes_de), gerar)
+
+@app.route("/api/v1/catalogo")
+def api_catalogo():
+    campos = campos_api(API_CAMPOS_PRODUTO)
+    versao_catalogo = db.session.query(func.count(Product.id), func.max(Product.id), func.max(Product.atualizado_em)).one()
+
+    def gerar():
+        produtos = Product.query.order_by(Product.valor_pontos.asc()).all()
+        return {"itens": [selecionar_campos(serializar_produto(p), campos) for p in produtos]}
+
+    return resposta_api(("catalogo", *versao_catalogo, campos), gerar)
+
 # --- Funções Internas e Inicialização ---
 
 def registrar_transacao(user: User, pontos: int, descricao: str) -> None:
-    transacao = Transaction(user_id=user.id, pontos=pontos, descricao=descricao)
-    user.saldo_total += pontos
+    tipo = 'credito' if pontos > 0 else 'ajuste'
+    transacao = Transaction(user_id=user.id, pontos=pontos, descricao=descricao, tipo=tipo)
+    # Soma no próprio UPDATE (como resgate e estorno): um crédito simultâneo a um
+    # resgate não sobrescreve o débito com o saldo lido antes
+    User.query.filter_by(id=user.id).update({User.saldo_total: User.saldo_total + pontos}, synchronize_session=False)
+    db.session.refresh(user, ["saldo_total"])
+    db.session.add(transacao)
+    if pontos > 0:
+        enfileirar_notificacao(user, "credito", f"Você recebeu {pontos} pontos ({descricao}). Saldo atual: {user.saldo_total} pontos.")
+
+def canal_notificacoes():
+    canal = app.config["NOTIFICACOES_CANAL"]
+    if canal == "webhook":
+        return CanalWebhook(os.environ["NOTIFICACOES_WEBHOOK_URL"], os.getenv("NOTIFICACOES_WEBHOOK_TOKEN"))
+    if canal == "email":
+        return CanalEmail(
+            os.environ["SMTP_HOST"], int(os.getenv("SMTP_PORT", "587")),
+            os.getenv("SMTP_USUARIO"), os.getenv("SMTP_SENHA"), os.getenv("SMTP_REMETENTE", "nao-responda@novomundodastintas.com.br"),
+        )
+    return CanalLog()
+
+PERIODOS_RELATORIO = ("dia", "semana", "mes")
+STATUS_RESGATE_VALIDO = ('pendente', 'concluido', 'entregue')
+
+_cache_relatorios: dict = {}
+
+def cache_curto(chave, calcular, ttl: int | None = None):
+    """Cache em memória (por worker) com expiração curta para os relatórios."""
+    ttl = app.config["RELATORIO_CACHE_TTL"] if ttl is None else ttl
+    agora = time.monotonic()
+    item = _cache_relatorios.get(chave)
+    if item and item[0] > agora:
+        return item[1]
+    valor = calcular()
+    _cache_relatorios[chave] = (agora + ttl, valor)
+    return valor
+
+def usa_postgres() -> bool:
+    return db.engine.dialect.name == "postgresql"
+
+def expr_periodo(coluna, periodo: str):
+    """Trunca uma data para o início do dia/semana/mês no formato AAAA-MM-DD."""
+    if usa_postgres():
+        trunc = {"dia": "day", "semana": "week", "mes": "month"}[periodo]
+        return func.to_char(func.date_trunc(trunc, coluna), "YYYY-MM-DD")
+    # SQLite (desenvolvimento local): semana começa na segunda-feira, como no Postgres
+    if periodo == "semana":
+        return func.date(coluna, "weekday 0", "-6 days")
+    if periodo == "mes":
+        return func.strftime("%Y-%m-01", coluna)
+    return func.date(coluna)
+
+def _filtro_resgate_valido():
+    return and_(Transaction.tipo == 'resgate', Transaction.status.in_(STATUS_RESGATE_VALIDO))
+
+def serie_extrato(periodo: str, desde: datetime, ate: datetime | None = None) -> dict:
+    """Pontos emitidos/resgatados por período, agregados direto em transaction_tintas."""
+    emitidos = case((and_(Transaction.pontos > 0, Transaction.status != 'reprovado'), Transaction.pontos), else_=0)
+    resgatados = case((_filtro_resgate_valido(), -Transaction.pontos), else_=0)
+    qtd = case((_filtro_resgate_valido(), 1), else_=0)
+    chave = expr_periodo(Transaction.data, periodo).label("periodo")
+    query = db.session.query(chave, func.sum(emitidos), func.sum(resgatados), func.sum(qtd)).filter(Transaction.data >= desde)
+    if ate is not None:
+        query = query.filter(Transaction.data < ate)
+    return {
+        linha[0]: {"pontos_emitidos": int(linha[1] or 0), "pontos_resgatados": int(linha[2] or 0), "qtd_resgates": int(linha[3] or 0)}
+        for linha in query.group_by(chave).all()
+    }
+
+def marcar_resumo_pendente(*filtros) -> None:
+    """Anota os dias dos lançamentos que serão apagados para o consolidar-resumo refazer."""
+    agora = datetime.utcnow()
+    dias = [
+        {"dia": date.fromisoformat(dia), "marcado_em": agora}
+        for (dia,) in db.session.query(expr_periodo(Transaction.data, "dia")).filter(*filtros).distinct()
+    ]
+    if dias:
+        insert = insert_postgres if usa_postgres() else insert_sqlite
+        comando = insert(ResumoPendente).values(dias)
+        db.session.execute(comando.on_conflict_do_update(index_elements=["dia"], set_={"marcado_em": comando.excluded.marcado_em}))
+
+def faixas_de_dias(dias) -> list[tuple[date, date]]:
+    """Agrupa dias consecutivos em faixas (primeiro, último): uma consulta por faixa."""
+    faixas = []
+    for dia in sorted(dias):
+        if faixas and dia == faixas[-1][1] + timedelta(days=1):
+            faixas[-1] = (faixas[-1][0], dia)
+        else:
+            faixas.append((dia, dia))
+    return faixas
+
+def serie_pontos(periodo: str, desde: datetime) -> list[dict]:
+    """Série do relatório; dias já consolidados vêm do resumo diário quando habilitado."""
+    corte = None
+    if app.config["RELATORIO_USAR_RESUMO"]:
+        corte = db.session.query(func.max(ResumoDiario.dia)).scalar()
+
+    if corte is None or corte < desde.date():
+        serie = serie_extrato(periodo, desde)
+    else:
+        chave = expr_periodo(ResumoDiario.dia, periodo).label("periodo")
+        linhas = db.session.query(
+            chave,
+            func.sum(ResumoDiario.pontos_emitidos),
+            func.sum(ResumoDiario.pontos_resgatados),
+            func.sum(ResumoDiario.qtd_resgates),
+        ).filter(ResumoDiario.dia >= desde.date(), ResumoDiario.dia <= corte).group_by(chave).all()
+        serie = {
+            linha[0]: {"pontos_emitidos": int(linha[1] or 0), "pontos_resgatados": int(linha[2] or 0), "qtd_resgates": int(linha[3] or 0)}
+            for linha in linhas
+        }
+        # Apenas os dias ainda não consolidados são lidos do extrato
+        recentes = serie_extrato(periodo, datetime.combine(corte + timedelta(days=1), datetime.min.time()))
+        for chave_periodo, valores in recentes.items():
+            atual = serie.setdefault(chave_periodo, {"pontos_emitidos": 0, "pontos_resgatados": 0, "qtd_resgates": 0})
+            for campo, valor in valores.items():
+                atual[campo] += valor
+
+    return [{"periodo": chave_periodo, **valores} for chave_periodo, valores in sorted(serie.items())]
+
+def top_produtos(desde: datetime, limite: int = 10) -> list[dict]:
+    """Prêmios mais resgatados no período (resgates de prêmios excluídos ficam sem product_id)."""
+    linhas = db.session.query(
+        Transaction.product_id,
+        func.max(Transaction.descricao),
+        func.count(Transaction.id).label("qtd"),
+        func.sum(-Transaction.pontos),
+    ).filter(
+        _filtro_resgate_valido(),
+        Transaction.product_id.isnot(None),
+        Transaction.data >= desde,
+    ).group_by(Transaction.product_id).order_by(func.count(Transaction.id).desc()).limit(limite).all()
+    nomes = dict(db.session.query(Product.id, Product.nome).filter(Product.id.in_([linha[0] for linha in linhas])).all()) if linhas else {}
+    return [
+        {
+            "product_id": product_id,
+            "produto": nomes.get(product_id) or descricao.removeprefix("Resgate:").strip(),
+            "qtd_resgates": int(qtd),
+            "pontos": int(pontos or 0),
+        }
+        for product_id, descricao, qtd, pontos in linhas
+    ]
+
+def resumo_pintores(desde: datetime) -> dict:
+    ativos, aguardando = db.session.query(
+        func.sum(case((User.ativo == True, 1), else_=0)),
+        func.sum(case((User.ativo == True, 0), else_=1)),
+    ).filter(User.role == 'pintor').one()
+    com_movimento = db.session.query(func.count(func.distinct(Transaction.user_id))).filter(Transaction.data >= desde).scalar()
+    return {"ativos": int(ativos or 0), "aguardando_ativacao": int(aguardando or 0), "com_movimento_no_periodo": int(com_movimento or 0)}
+
+def fila_resgates() -> dict:
+    """Resgates pendentes de aprovação e aprovados aguardando retirada."""
+    linhas = db.session.query(
+        Transaction.status, func.count(Transaction.id), func.sum(-Transaction.pontos), func.min(Transaction.data),
+    ).filter(Transaction.tipo == 'resgate', Transaction.status.in_(('pendente', 'concluido'))).group_by(Transaction.status).all()
+    fila = {status: {"qtd": 0, "pontos": 0, "mais_antigo": None} for status in ('pendente', 'concluido')}
+    for status, qtd, pontos, mais_antigo in linhas:
+        fila[status] = {"qtd": int(qtd), "pontos": int(pontos or 0), "mais_antigo": mais_antigo.isoformat() if mais_antigo else None}
+    return fila
+
+def montar_relatorio(periodo: str, dias: int) -> dict:
+    if periodo not in PERIODOS_RELATORIO:
+        periodo = "dia"
+    dias = min(max(dias, 1), 730)
+
+    def calcular():
+        desde = datetime.combine(datetime.utcnow().date() - timedelta(days=dias - 1), datetime.min.time())
+        serie = serie_pontos(periodo, desde)
+        return {
+            "periodo": periodo,
+            "dias": dias,
+            "desde": desde.date().isoformat(),
+            "gerado_em": datetime.utcnow().isoformat(timespec="seconds"),
+            "totais": {
+                "pontos_emitidos": sum(item["pontos_emitidos"] for item in serie),
+                "pontos_resgatados": sum(item["pontos_resgatados"] for item in serie),
+                "qtd_resgates": sum(item["qtd_resgates"] for item in serie),
+            },
+            "serie": serie,
+            "top_produtos": top_produtos(desde),
+            "pintores": resumo_pintores(desde),
+            "fila_resgates": fila_resgates(),
+        }
+
+    return cache_curto(("relatorio", periodo, dias), calcular)
+
+def reservar_resgate(user: User, produto: Product) -> str | None:
+    """Reserva uma unidade do prêmio e debita o saldo numa única transação do banco.
+
+    Os dois UPDATEs são condicionais (estoque > 0, saldo suficiente) e bloqueiam as
+    linhas até o commit, então resgates simultâneos nunca vendem além do estoque nem
+    deixam saldo negativo. Retorna None em caso de sucesso, "estoque" ou "saldo".
+
+    Prêmios sem limite de estoque não são regravados: um UPDATE mudaria
+    atualizado_em e, com ele, o ETag do catálogo da API a cada resgate.
+    """
+    valor = produto.valor_pontos
+    # FOR SHARE: resgates simultâneos não se bloqueiam, mas a edição do prêmio espera o commit
+    reservado = produto.estoque is None and db.session.query(Product.id).filter(
+        Product.id == produto.id, Product.valor_pontos == valor, Product.estoque.is_(None),
+    ).with_for_update(read=True).first() is not None
+    if not reservado:
+        reservado = Product.query.filter(
+            Product.id == produto.id, Product.valor_pontos == valor, Product.estoque > 0,
+        ).update({Product.estoque: Product.estoque - 1}, synchronize_session=False)
+    if not reservado:
+        db.session.rollback()
+        return "estoque"
+
+    debitado = User.query.filter(User.id == user.id, User.saldo_total >= valor).update(
+        {User.saldo_total: User.saldo_total - valor}, synchronize_session=False
+    )
+    if not debitado:
+        db.session.rollback()
+        return "saldo"
+
+    transacao = Transaction(
+        user_id=user.id, pontos=-valor,
+        descricao=f"Resgate: {produto.nome}", status='pendente',
+        tipo='resgate', product_id=produto.id
+    )
     db.session.add(transacao)
+    db.session.flush()
+    publicar_evento(
+        "resgate_criado", id=transacao.id, user_id=user.id, nome=user.nome,
+        descricao=transacao.descricao, pontos=transacao.pontos, data=transacao.data.isoformat(),
+    )
+    db.session.commit()
+    return None
+
+# Identifica o processo nos ids SSE (a sequência do barramento é local a cada worker)
+ID_PROCESSO = uuid.uuid4().hex[:8]
+
+def publicar_evento(tipo: str, **dados) -> None:
+    """Publica um evento do painel junto com a transação atual (só sai após o commit).
+
+    No Postgres usa NOTIFY, que o banco entrega a todos os workers no commit; no
+    SQLite os eventos ficam na sessão e vão para o barramento local no after_commit.
+    """
+    evento = {"tipo": tipo, **dados}
+    if usa_postgres():
+        db.session.execute(select(func.pg_notify(CANAL_RESGATES, json.dumps(evento))))
+    else:
+        db.session.info.setdefault("eventos_pendentes", []).append(evento)
+
+@event.listens_for(Session, "after_commit")
+def _enviar_eventos_pendentes(sessao) -> None:
+    for evento in sessao.info.pop("eventos_pendentes", []):
+        barramento.publicar(evento)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _descartar_eventos_pendentes(sessao, transacao_anterior) -> None:
+    sessao.info.pop("eventos_pendentes", None)
+
+def subtrair_meses(data: datetime, meses: int) -> datetime:
+    ano, mes = divmod(data.year * 12 + data.month - 1 - meses, 12)
+    dia = min(data.day, calendar.monthrange(ano, mes + 1)[1])
+    return data.replace(year=ano, month=mes + 1, day=dia)
+
+def pontos_vencidos(corte: datetime):
+    """(user_id, pontos) ainda não consumidos de créditos anteriores ao corte.
+
+    Em FIFO os débitos (resgates, ajustes e expirações já lançadas) consomem sempre
+    os créditos mais antigos, então o que sobra dos créditos vencidos é
+    créditos_até_o_corte - débitos_totais, quando positivo.
+    """
+    creditos_vencidos = func.sum(case((and_(Transaction.pontos > 0, Transaction.data < corte), Transaction.pontos), else_=0))
+    debitos = func.sum(case((Transaction.pontos < 0, -Transaction.pontos), else_=0))
+    return db.session.query(Transaction.user_id, creditos_vencidos - debitos).filter(
+        Transaction.status != 'reprovado'
+    ).group_by(Transaction.user_id).having(creditos_vencidos > debitos)
+
+def pontos_a_expirar(user_id: int, dias: int | None = None) -> tuple[int, datetime]:
+    """Pontos do pintor que expiram nos próximos dias (padrão PONTOS_AVISO_DIAS)."""
+    dias = app.config["PONTOS_AVISO_DIAS"] if dias is None else dias
+    limite = datetime.utcnow() + timedelta(days=dias)
+    linha = pontos_vencidos(subtrair_meses(limite, app.config["PONTOS_VALIDADE_MESES"])).filter(
+        Transaction.user_id == user_id
+    ).first()
+    return (int(linha[1]) if linha else 0), limite
+
+def salvar_imagem(file) -> str:
+    """Grava a imagem pelo hash do conteúdo e devolve a imagem_url.
+
+    A mesma imagem enviada de novo gera a mesma URL; se algum prêmio já a usa, o
+    objeto existe e o envio é dispensado. Caso contrário o objeto é (re)enviado, o
+    que também renova sua data e o protege do limpar-imagens.
+    """
+    dados = file.read()
+    chave = chave_conteudo(dados, file.filename)
+    url = armazenamento.url(chave)
+    if not Product.query.filter_by(imagem_url=url).first():
+        armazenamento.enviar(chave, dados)
+    return url
+
+def campos_api(permitidos: tuple[str, ...]) -> tuple[str, ...]:
+    """Campos pedidos em ?campos=a,b (apenas os permitidos); sem o parâmetro, todos."""
+    pedidos = {campo.strip() for campo in (request.args.get("campos") or "").split(",")}
+    return tuple(campo for campo in permitidos if campo in pedidos) or permitidos
+
+def selecionar_campos(item: dict, campos: tuple[str, ...]) -> dict:
+    return {campo: item[campo] for campo in campos}
+
+def serializar_transacao(t: Transaction) -> dict:
+    return {
+        "id": t.id, "data": t.data.isoformat(), "descricao": t.descricao, "pontos": t.pontos,
+        "tipo": t.tipo, "status": t.status, "product_id": t.product_id,
+    }
+
+def serializar_produto(p: Product) -> dict:
+    imagem_url = p.imagem_url if p.imagem_url.startswith("http") else url_for("static", filename=p.imagem_url, _external=True)
+    return {
+        "id": p.id, "nome": p.nome, "descricao": p.descricao, "valor_pontos": p.valor_pontos,
+        "imagem_url": imagem_url, "estoque": p.estoque, "disponivel": p.estoque is None or p.estoque > 0,
+    }
+
+def resposta_api(versao: tuple, gerar) -> Response:
+    """JSON com ETag derivado das versões das linhas envolvidas.
+
+    Se o If-None-Match do cliente bate, devolve 304 sem nem montar o corpo.
+    """
+    etag = hashlib.sha1(repr(("v1", *versao)).encode("utf-8")).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        resposta = Response(status=304)
+    else:
+        resposta = jsonify(gerar())
+    resposta.set_etag(etag)
+    resposta.headers["Cache-Control"] = "private, no-cache"
+    return resposta
+
+def parse_data(value) -> date | None:
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+def filtros_periodo() -> list:
+    """Filtros de data do extrato a partir de ?de=AAAA-MM-DD&ate=AAAA-MM-DD (inclusivos)."""
+    filtros = []
+    de, ate = parse_data(request.args.get("de")), parse_data(request.args.get("ate"))
+    if de:
+        filtros.append(Transaction.data >= datetime.combine(de, datetime.min.time()))
+    if ate:
+        filtros.append(Transaction.data < datetime.combine(ate + timedelta(days=1), datetime.min.time()))
+    return filtros
+
+def resposta_exportacao(formato: str, nome: str, cabecalho: list[str], query) -> Response:
+    """Resposta em streaming: o download começa já com o cabeçalho e a consulta é lida
+    em lotes (yield_per, cursor no servidor no Postgres), com memória constante."""
+    gerador, mimetype = FORMATOS_EXPORTACAO[formato]
+    arquivo = f"Relatorio_PinturaFiel_{nome}_{datetime.now():%Y%m%d_%H%M}.{formato}"
+    conteudo = gerador(cabecalho, query) if formato == "csv" else gerador(cabecalho, query, aba=nome.title())
+    return Response(
+        stream_with_context(conteudo), mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{arquivo}"', "X-Accel-Buffering": "no"},
+    )
+
+def parse_estoque(value) -> int | None:
+    """Campo de estoque do formulário: vazio = sem controle de estoque."""
+    if value is None or str(value).strip() == "":
+        return None
+    return max(parse_int(value, 0), 0)
 
 def parse_int(value, default=0) -> int:
     try:
@@ -432,6 +1441,98 @@ def parse_int(value, default=0) -> int:
     except (TypeError, ValueError):
         return default
 
+def adicionar_colunas() -> set[str]:
+    """Adiciona colunas novas dos modelos em tabelas existentes. Retorna 'tabela.coluna' criadas."""
+    inspetor = inspect(db.engine)
+    criadas = set()
+    with db.engine.begin() as conexao:
+        for tabela in db.metadata.sorted_tables:
+            if not inspetor.has_table(tabela.name):
+                continue
+            existentes = {coluna["name"] for coluna in inspetor.get_columns(tabela.name)}
+            for coluna in tabela.columns:
+                if coluna.name in existentes:
+                    continue
+                # IF NOT EXISTS (Postgres): outra execução pode ter criado a coluna depois da inspeção
+                se_nao_existe = "IF NOT EXISTS " if usa_postgres() else ""
+                ddl = f"ALTER TABLE {tabela.name} ADD COLUMN {se_nao_existe}{coluna.name} {coluna.type.compile(dialect=db.engine.dialect)}"
+                if coluna.server_default is not None:
+                    ddl += f" DEFAULT '{coluna.server_default.arg}'"
+                if not coluna.nullable and coluna.server_default is not None:
+                    ddl += " NOT NULL"
+                for fk in coluna.foreign_keys:
+                    ddl += f" REFERENCES {fk.column.table.name}({fk.column.name})"
+                    if fk.ondelete:
+                        ddl += f" ON DELETE {fk.ondelete}"
+                conexao.exec_driver_sql(ddl)
+                criadas.add(f"{tabela.name}.{coluna.name}")
+    return criadas
+
+def migrar_transacoes() -> tuple[int, int, int]:
+    """Preenche tipo e product_id das transações antigas a partir da descrição.
+
+    Decide só pelos dados (débitos ainda como 'credito'), então pode rodar a cada
+    deploy: pega também lançamentos gravados por workers antigos durante a troca.
+    """
+    resgates = Transaction.query.filter(
+        Transaction.tipo != 'resgate', Transaction.pontos < 0, Transaction.descricao.like("Resgate:%")
+    ).update({Transaction.tipo: 'resgate'}, synchronize_session=False)
+    ajustes = Transaction.query.filter(
+        Transaction.tipo == 'credito', Transaction.pontos < 0
+    ).update({Transaction.tipo: 'ajuste'}, synchronize_session=False)
+    # Liga o resgate ao prêmio pelo nome gravado na descrição (nomes repetidos: menor id)
+    produto_por_nome = (
+        select(func.min(Product.id))
+        .where(literal("Resgate: ") + Product.nome == Transaction.descricao)
+        .scalar_subquery()
+    )
+    vinculados = Transaction.query.filter(
+        Transaction.tipo == 'resgate', Transaction.product_id.is_(None), produto_por_nome.isnot(None)
+    ).update({Transaction.product_id: produto_por_nome}, synchronize_session=False)
+    db.session.commit()
+    return resgates, ajustes, vinculados
+
+@app.cli.command("migrar-transacoes")
+def migrar_transacoes_cmd():
+    """Reprocessa tipo/product_id das transações antigas (idempotente)."""
+    resgates, ajustes, vinculados = migrar_transacoes()
+    click.echo(f"{resgates} resgate(s) e {ajustes} ajuste(s) classificados; {vinculados} resgate(s) vinculados a prêmios.")
+
+def criar_indices() -> list[str]:
+    """Cria índices novos em tabelas já existentes (create_all só cria em tabelas novas).
+
+    No Postgres usa CREATE INDEX CONCURRENTLY: o extrato continua aceitando
+    gravações enquanto o índice é montado. Retorna os nomes criados.
+    """
+    if not usa_postgres():
+        criados = []
+        for tabela in db.metadata.sorted_tables:
+            existentes = {existente["name"] for existente in inspect(db.engine).get_indexes(tabela.name)}
+            for indice in tabela.indexes:
+                if indice.name not in existentes:
+                    indice.create(db.engine)
+                    criados.append(indice.name)
+        return criados
+
+    criados = []
+    # CONCURRENTLY não roda dentro de transação
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conexao:
+        for tabela in db.metadata.sorted_tables:
+            for indice in tabela.indexes:
+                valido = conexao.exec_driver_sql(
+                    "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s",
+                    (indice.name,),
+                ).scalar()
+                if valido:
+                    continue
+                if valido is False:
+                    # Sobra de um CONCURRENTLY interrompido: o índice existe, mas inválido
+                    conexao.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {indice.name}")
+                ddl = str(CreateIndex(indice).compile(dialect=db.engine.dialect))
+                conexao.exec_driver_sql(re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl))
+                criados.append(indice.name)
+    return criados
+
 def seed_data() -> None:
     if not User.query.filter_by(role="admin").first():
         admin = User(
@@ -441,9 +1542,40 @@ def seed_data() -> None:
         db.session.add(admin)
         db.session.commit()
 
-with app.app_context():
-    db.create_all()
-    seed_data()
+# Chave do advisory lock que serializa execuções simultâneas de atualizar-banco
+TRAVA_ATUALIZAR_BANCO = 720027
+
+def atualizar_banco(log=print) -> None:
+    """Cria tabelas, colunas e índices novos, reclassifica o extrato antigo e garante o admin.
+
+    Idempotente. Roda uma vez por deploy, antes do gunicorn subir os workers (ver
+    Dockerfile): no import, cada worker faria o mesmo DDL ao mesmo tempo. No Postgres
+    um advisory lock serializa execuções simultâneas (várias réplicas subindo juntas).
+    """
+    with db.engine.connect() as trava:
+        if usa_postgres():
+            trava.exec_driver_sql(f"SELECT pg_advisory_lock({TRAVA_ATUALIZAR_BANCO})")
+            trava.commit()
+        try:
+            db.create_all()
+            for coluna in sorted(adicionar_colunas()):
+                log(f"coluna criada: {coluna}")
+            resgates, ajustes, vinculados = migrar_transacoes()
+            log(f"{resgates} resgate(s) e {ajustes} ajuste(s) classificados; {vinculados} resgate(s) vinculados a prêmios.")
+            for indice in criar_indices():
+                log(f"índice criado: {indice}")
+            seed_data()
+        finally:
+            if usa_postgres():
+                trava.exec_driver_sql(f"SELECT pg_advisory_unlock({TRAVA_ATUALIZAR_BANCO})")
+                trava.commit()
+
+@app.cli.command("atualizar-banco")
+def atualizar_banco_cmd():
+    """Aplica as mudanças de esquema e a reclassificação do extrato (rodar a cada deploy)."""
+    atualizar_banco(log=click.echo)
 
 if __name__ == "__main__":
+    with app.app_context():
+        atualizar_banco()
     app.run(debug=True)
@@ -0,0 +1,102 @@
+import hashlib
+import mimetypes
+import os
+from datetime import datetime, timezone
+
+# Conteúdo endereçado por hash nunca muda: pode ficar em cache por 1 ano
+CACHE_IMUTAVEL = "31536000"
+
+
+def chave_conteudo(dados: bytes, nome_original: str) -> str:
+    """Nome do objeto a partir do conteúdo: imagens iguais geram a mesma chave."""
+    extensao = nome_original.rsplit(".", 1)[1].lower() if "." in nome_original else "bin"
+    return f"{hashlib.sha256(dados).hexdigest()}.{extensao}"
+
+
+class ArmazenamentoSupabase:
+    """Bucket do Supabase Storage; objetos em public/<sha256>.<ext>."""
+
+    PASTA = "public"
+
+    def __init__(self, cliente, bucket: str):
+        self.bucket = bucket
+        self._arquivos = cliente.storage.from_(bucket)
+        # Trecho da URL pública que antecede o caminho do objeto
+        self._marcador = f"/object/public/{bucket}/"
+
+    def url(self, chave: str) -> str:
+        return self._arquivos.get_public_url(f"{self.PASTA}/{chave}")
+
+    def enviar(self, chave: str, dados: bytes) -> None:
+        tipo = mimetypes.guess_type(chave)[0] or "application/octet-stream"
+        # upsert: se sobrou um objeto órfão com o mesmo hash, o conteúdo é idêntico
+        # e o updated_at renovado tira o objeto da lista do limpar-imagens
+        self._arquivos.upload(
+            f"{self.PASTA}/{chave}", dados,
+            {"content-type": tipo, "cache-control": CACHE_IMUTAVEL, "upsert": "true"},
+        )
+
+    def caminho_da_url(self, url: str) -> str | None:
+        if self._marcador not in url:
+            return None
+        return url.split(self._marcador, 1)[1].split("?", 1)[0]
+
+    def listar(self):
+        """(caminho, alterado_em) de todos os objetos da pasta, paginando a API."""
+        inicio = 0
+        while True:
+            pagina = self._arquivos.list(self.PASTA, {"limit": 1000, "offset": inicio})
+            for objeto in pagina:
+                if objeto.get("id") is None:  # subpasta
+                    continue
+                # Upsert mantém created_at; updated_at reflete o último envio
+                alterado_em = objeto.get("updated_at") or objeto["created_at"]
+                yield f"{self.PASTA}/{objeto['name']}", datetime.fromisoformat(alterado_em.replace("Z", "+00:00"))
+            if len(pagina) < 1000:
+                break
+            inicio += 1000
+
+    def remover(self, caminhos: list[str]) -> None:
+        for inicio in range(0, len(caminhos), 100):
+            self._arquivos.remove(caminhos[inicio:inicio + 100])
+
+
+class ArmazenamentoLocal:
+    """Pasta static/uploads; imagem_url fica relativa a static (uploads/<sha256>.<ext>)."""
+
+    PASTA = "uploads"
+
+    def __init__(self, pasta_static: str):
+        self.diretorio = os.path.join(pasta_static, self.PASTA)
+
+    def url(self, chave: str) -> str:
+        return f"{self.PASTA}/{chave}"
+
+    def enviar(self, chave: str, dados: bytes) -> None:
+        os.makedirs(self.diretorio, exist_ok=True)
+        destino = os.path.join(self.diretorio, chave)
+        if os.path.exists(destino):
+            # Órfão reaproveitado: renova a data para o limpar-imagens não apagá-lo
+            os.utime(destino)
+            return
+        temporario = f"{destino}.{os.getpid()}.tmp"
+        with open(temporario, "wb") as arquivo:
+            arquivo.write(dados)
+        os.replace(temporario, destino)
+
+    def caminho_da_url(self, url: str) -> str | None:
+        if url.startswith("http") or not url.startswith(f"{self.PASTA}/"):
+            return None
+        return url
+
+    def listar(self):
+        if not os.path.isdir(self.diretorio):
+            return
+        for nome in os.listdir(self.diretorio):
+            completo = os.path.join(self.diretorio, nome)
+            if os.path.isfile(completo) and not nome.endswith(".tmp"):
+                yield f"{self.PASTA}/{nome}", datetime.fromtimestamp(os.path.getmtime(completo), tz=timezone.utc)
+
+    def remover(self, caminhos: list[str]) -> None:
+        for caminho in caminhos:
+            os.remove(os.path.join(self.diretorio, caminho.split("/", 1)[1]))
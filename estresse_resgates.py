@@ -0,0 +1,121 @@
+"""Teste de estresse dos resgates: muitos pedidos simultâneos contra estoque e saldo pequenos.
+
+Uso:
+    python estresse_resgates.py                    # SQLite temporário
+    DATABASE_URL=postgresql://.../homologacao python estresse_resgates.py --pintores 100
+
+Cenários (todas as requisições de cada um partem juntas, uma thread por pedido):
+    estoque: N pintores com saldo de sobra pedem o mesmo prêmio de estoque E;
+             exatamente E resgates, estoque final 0, nenhum saldo negativo.
+    saldo:   um pintor com saldo para S resgates faz vários pedidos de um prêmio
+             sem limite; exatamente S resgates e saldo final 0.
+
+Os dados criados são apagados no fim, então pode ser repetido no mesmo banco.
+Sai com código 1 se alguma verificação falhar.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import uuid
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'estresse.db')}"
+
+from app import app, atualizar_banco  # noqa: E402  (DATABASE_URL precisa estar definido antes)
+from models import Notificacao, Product, Transaction, User, db  # noqa: E402
+
+VALOR = 50
+
+
+def disparar(pedidos: list[tuple[int, int]]) -> list[int]:
+    """Faz os POST /resgatar/<produto> de cada (user_id, produto_id) ao mesmo tempo."""
+    largada = threading.Barrier(len(pedidos))
+    status = []
+
+    def pedir(user_id, produto_id):
+        cliente = app.test_client()
+        with cliente.session_transaction() as sessao:
+            sessao["_user_id"] = str(user_id)
+            sessao["_fresh"] = True
+        largada.wait()
+        status.append(cliente.post(f"/resgatar/{produto_id}").status_code)
+
+    threads = [threading.Thread(target=pedir, args=pedido) for pedido in pedidos]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return status
+
+
+def conferir(nome: str, condicao: bool, detalhe: str) -> bool:
+    print(f"  [{'ok' if condicao else 'FALHOU'}] {nome}: {detalhe}")
+    return condicao
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pintores", type=int, default=40)
+    parser.add_argument("--tentativas", type=int, default=2, help="Pedidos simultâneos de cada pintor.")
+    parser.add_argument("--estoque", type=int, default=7)
+    parser.add_argument("--saldo-resgates", type=int, default=3, help="Resgates que cabem no saldo (cenário saldo).")
+    parser.add_argument("--pedidos-saldo", type=int, default=20)
+    args = parser.parse_args()
+
+    rodada = uuid.uuid4().hex[:6]
+    with app.app_context():
+        atualizar_banco(log=lambda mensagem: None)
+        pintores = [
+            User(nome=f"Estresse {rodada} {i}", telefone=f"00{rodada}{i:05d}", senha_hash="x", role="pintor",
+                 ativo=True, saldo_total=VALOR * args.tentativas)
+            for i in range(args.pintores)
+        ]
+        limitado = Product(nome=f"Estresse {rodada} limitado", descricao="", valor_pontos=VALOR,
+                           imagem_url="", categoria="Geral", estoque=args.estoque)
+        ilimitado = Product(nome=f"Estresse {rodada} ilimitado", descricao="", valor_pontos=VALOR,
+                            imagem_url="", categoria="Geral", estoque=None)
+        db.session.add_all([*pintores, limitado, ilimitado])
+        db.session.commit()
+        ids_pintores = [pintor.id for pintor in pintores]
+        ids_produtos = [limitado.id, ilimitado.id]
+
+    aprovado = True
+    try:
+        print(f"estoque: {args.pintores} pintores x {args.tentativas} pedidos, estoque {args.estoque}")
+        status = disparar([(user_id, ids_produtos[0]) for user_id in ids_pintores for _ in range(args.tentativas)])
+        with app.app_context():
+            resgates = Transaction.query.filter_by(product_id=ids_produtos[0], tipo='resgate').count()
+            estoque = db.session.get(Product, ids_produtos[0]).estoque
+            negativos = User.query.filter(User.id.in_(ids_pintores), User.saldo_total < 0).count()
+            aprovado &= conferir("erros HTTP", all(codigo < 500 for codigo in status), f"{sorted(set(status))}")
+            aprovado &= conferir("resgates", resgates == args.estoque, f"{resgates} (esperado {args.estoque})")
+            aprovado &= conferir("estoque final", estoque == 0, f"{estoque}")
+            aprovado &= conferir("saldos negativos", negativos == 0, f"{negativos}")
+
+        print(f"saldo: 1 pintor com saldo para {args.saldo_resgates}, {args.pedidos_saldo} pedidos de prêmio sem limite")
+        with app.app_context():
+            User.query.filter_by(id=ids_pintores[0]).update({User.saldo_total: VALOR * args.saldo_resgates})
+            db.session.commit()
+        status = disparar([(ids_pintores[0], ids_produtos[1])] * args.pedidos_saldo)
+        with app.app_context():
+            resgates = Transaction.query.filter_by(product_id=ids_produtos[1], tipo='resgate').count()
+            saldo = db.session.get(User, ids_pintores[0]).saldo_total
+            aprovado &= conferir("erros HTTP", all(codigo < 500 for codigo in status), f"{sorted(set(status))}")
+            aprovado &= conferir("resgates", resgates == args.saldo_resgates, f"{resgates} (esperado {args.saldo_resgates})")
+            aprovado &= conferir("saldo final", saldo == 0, f"{saldo}")
+    finally:
+        with app.app_context():
+            Transaction.query.filter(Transaction.user_id.in_(ids_pintores)).delete(synchronize_session=False)
+            Notificacao.query.filter(Notificacao.user_id.in_(ids_pintores)).delete(synchronize_session=False)
+            User.query.filter(User.id.in_(ids_pintores)).delete(synchronize_session=False)
+            Product.query.filter(Product.id.in_(ids_produtos)).delete(synchronize_session=False)
+            db.session.commit()
+
+    print("OK" if aprovado else "FALHOU")
+    return 0 if aprovado else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import json
+import select
+import threading
+import time
+from collections import deque
+
+# Canal do LISTEN/NOTIFY no Postgres
+CANAL_RESGATES = "resgates_tintas"
+
+
+class BarramentoEventos:
+    """Buffer em memória dos últimos eventos; cada conexão SSE acompanha pela sequência."""
+
+    def __init__(self, tamanho: int = 500):
+        self._eventos = deque(maxlen=tamanho)
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    @property
+    def ultimo(self) -> int:
+        return self._seq
+
+    def publicar(self, evento: dict) -> int:
+        with self._cond:
+            self._seq += 1
+            self._eventos.append((self._seq, evento))
+            self._cond.notify_all()
+            return self._seq
+
+    def aguardar(self, depois_de: int, timeout: float) -> list[tuple[int, dict]]:
+        """Eventos com sequência maior que `depois_de`, esperando até `timeout` segundos."""
+        with self._cond:
+            if self._seq <= depois_de:
+                self._cond.wait(timeout)
+            return [(seq, evento) for seq, evento in self._eventos if seq > depois_de]
+
+
+barramento = BarramentoEventos()
+
+
+class LimiteConexoes:
+    """Conta as conexões SSE abertas no processo para não ocupar todas as threads do worker."""
+
+    def __init__(self):
+        self._abertas = 0
+        self._trava = threading.Lock()
+
+    def entrar(self, maximo: int) -> bool:
+        with self._trava:
+            if self._abertas >= maximo:
+                return False
+            self._abertas += 1
+            return True
+
+    def sair(self) -> None:
+        with self._trava:
+            self._abertas -= 1
+
+
+conexoes_sse = LimiteConexoes()
+
+_ouvinte: threading.Thread | None = None
+_trava_ouvinte = threading.Lock()
+
+
+def iniciar_ouvinte_postgres(engine) -> None:
+    """Sobe (uma vez por processo) a thread que faz LISTEN e repassa ao barramento local."""
+    global _ouvinte
+    with _trava_ouvinte:
+        if _ouvinte is not None and _ouvinte.is_alive():
+            return
+        _ouvinte = threading.Thread(target=_escutar, args=(engine,), name="listen-resgates", daemon=True)
+        _ouvinte.start()
+
+
+def _escutar(engine) -> None:
+    while True:
+        try:
+            # Conexão dedicada: sai do pool para ficar presa ao LISTEN
+            conexao = engine.raw_connection()
+            conexao.detach()
+            bruta = conexao.dbapi_connection
+            bruta.autocommit = True
+            try:
+                bruta.cursor().execute(f"LISTEN {CANAL_RESGATES}")
+                while True:
+                    if select.select([bruta], [], [], 30) == ([], [], []):
+                        continue
+                    bruta.poll()
+                    while bruta.notifies:
+                        aviso = bruta.notifies.pop(0)
+                        barramento.publicar(json.loads(aviso.payload))
+            finally:
+                conexao.close()
+        except Exception as e:
+            print(f"Erro no LISTEN {CANAL_RESGATES}: {e}")
+            time.sleep(5)
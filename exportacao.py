@@ -0,0 +1,143 @@
+import csv
+import re
+import zipfile
+from datetime import date, datetime
+from io import StringIO
+from xml.sax.saxutils import escape
+
+# Linhas agrupadas por pedaço enviado ao cliente
+LINHAS_POR_PEDACO = 500
+# Limite de linhas de uma planilha do Excel (incluindo o cabeçalho)
+MAX_LINHAS_XLSX = 1_048_576
+
+_CONTROLE_INVALIDO = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+# Início de célula que o Excel interpreta como fórmula (=HYPERLINK(...) num nome cadastrado)
+_INICIO_FORMULA = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _texto(valor) -> str:
+    if valor is None:
+        return ""
+    if isinstance(valor, bool):
+        return "Sim" if valor else "Não"
+    if isinstance(valor, datetime):
+        return valor.strftime("%d/%m/%Y %H:%M")
+    if isinstance(valor, date):
+        return valor.strftime("%d/%m/%Y")
+    return str(valor)
+
+
+def _texto_csv(valor) -> str:
+    """Como _texto, mas textos que começariam uma fórmula ganham um apóstrofo na frente."""
+    texto = _texto(valor)
+    if isinstance(valor, str) and texto.startswith(_INICIO_FORMULA):
+        return "'" + texto
+    return texto
+
+
+def gerar_csv(cabecalho, linhas):
+    """CSV em UTF-8 com BOM (abre com acentos no Excel), enviado em pedaços."""
+    buffer = StringIO()
+    escritor = csv.writer(buffer)
+    buffer.write("\ufeff")
+    escritor.writerow(cabecalho)
+    for contador, linha in enumerate(linhas, start=1):
+        escritor.writerow([_texto_csv(valor) for valor in linha])
+        if contador % LINHAS_POR_PEDACO == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+class _SaidaZip:
+    """Arquivo só de escrita: o zipfile grava aqui e o gerador drena os bytes."""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, dados) -> int:
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self) -> None:
+        pass
+
+    def drenar(self) -> bytes:
+        dados = b"".join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def _celula(valor) -> str:
+    if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        return f'<c t="n"><v>{valor}</v></c>'
+    texto = escape(_CONTROLE_INVALIDO.sub("", _texto(valor)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _linha_xml(valores) -> str:
+    return "<row>" + "".join(_celula(valor) for valor in valores) + "</row>"
+
+
+_ARQUIVOS_FIXOS_XLSX = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        "</Relationships>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        "</Relationships>"
+    ),
+}
+
+
+def gerar_xlsx(cabecalho, linhas, aba: str = "Dados"):
+    """Planilha XLSX mínima (uma aba, strings inline) montada em streaming.
+
+    O zip é escrito com descritores de dados, então nada precisa ser mantido em
+    memória além do pedaço atual. Linhas além do limite do Excel são descartadas.
+    """
+    saida = _SaidaZip()
+    with zipfile.ZipFile(saida, "w", compression=zipfile.ZIP_DEFLATED) as pacote:
+        for nome, conteudo in _ARQUIVOS_FIXOS_XLSX.items():
+            pacote.writestr(nome, conteudo)
+        pacote.writestr("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(aba[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+            "</workbook>"
+        ))
+        yield saida.drenar()
+
+        with pacote.open("xl/worksheets/sheet1.xml", "w") as planilha:
+            planilha.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                + _linha_xml(cabecalho)
+            ).encode("utf-8"))
+            pedaco = []
+            for contador, linha in enumerate(linhas, start=2):
+                if contador > MAX_LINHAS_XLSX:
+                    break
+                pedaco.append(_linha_xml(linha))
+                if len(pedaco) == LINHAS_POR_PEDACO:
+                    planilha.write("".join(pedaco).encode("utf-8"))
+                    pedaco.clear()
+                    yield saida.drenar()
+            planilha.write(("".join(pedaco) + "</sheetData></worksheet>").encode("utf-8"))
+    yield saida.drenar()
@@ -4,6 +4,10 @@ from flask_login import UserMixin
 
 db = SQLAlchemy()
 
+# Valores aceitos em Transaction.tipo e Transaction.status
+TIPOS_TRANSACAO = ('credito', 'resgate', 'ajuste', 'expiracao')
+STATUS_TRANSACAO = ('aprovado', 'pendente', 'concluido', 'entregue', 'reprovado')
+
 class User(db.Model, UserMixin):
     __tablename__ = 'user_tintas'
     id = db.Column(db.Integer, primary_key=True)
@@ -19,6 +23,8 @@ class User(db.Model, UserMixin):
     saldo_total = db.Column(db.Integer, nullable=False, default=0)
     role = db.Column(db.String(20), nullable=False, default='pintor') 
     ativo = db.Column(db.Boolean, default=False) 
+    # Versão da linha (ETag da API); onupdate vale também para UPDATEs em lote
+    atualizado_em = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     transacoes = db.relationship("Transaction", backref="user_obj", lazy=True)
 
@@ -30,12 +36,67 @@ class Product(db.Model):
     valor_pontos = db.Column(db.Integer, nullable=False)
     imagem_url = db.Column(db.String(255), nullable=False)
     categoria = db.Column(db.String(60), nullable=False)
+    # Unidades disponíveis para resgate; NULL = sem controle de estoque
+    estoque = db.Column(db.Integer, nullable=True)
+    atualizado_em = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class Transaction(db.Model):
     __tablename__ = 'transaction_tintas'
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user_tintas.id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user_tintas.id"), nullable=False, index=True)
     pontos = db.Column(db.Integer, nullable=False)
     data = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     descricao = db.Column(db.String(255), nullable=False)
-    status = db.Column(db.String(20), nullable=False, default='aprovado')
\ No newline at end of file
+    # Enum sem tipo nativo: continua VARCHAR(20) no banco, validado pelo SQLAlchemy
+    status = db.Column(
+        db.Enum(*STATUS_TRANSACAO, name="status_transacao", native_enum=False, create_constraint=False, validate_strings=True, length=20),
+        nullable=False, default='aprovado', index=True,
+    )
+    tipo = db.Column(
+        db.Enum(*TIPOS_TRANSACAO, name="tipo_transacao", native_enum=False, create_constraint=False, validate_strings=True, length=20),
+        nullable=False, default='credito', server_default='credito', index=True,
+    )
+    # Prêmio resgatado (apenas tipo='resgate'); a descrição guarda o nome na data do resgate
+    product_id = db.Column(db.Integer, db.ForeignKey("product_tintas.id", ondelete="SET NULL"), nullable=True, index=True)
+    atualizado_em = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    produto = db.relationship("Product", lazy=True)
+
+# Índice usado pelos relatórios (GROUP BY por período em transaction_tintas)
+db.Index("ix_transaction_tintas_data", Transaction.data)
+# Lançamentos alterados desde a última consolidação do resumo diário
+db.Index("ix_transaction_tintas_atualizado_em", Transaction.atualizado_em)
+
+class ResumoDiario(db.Model):
+    # Consolidação noturna do extrato (flask consolidar-resumo), um registro por dia
+    __tablename__ = 'resumo_diario_tintas'
+    dia = db.Column(db.Date, primary_key=True)
+    pontos_emitidos = db.Column(db.Integer, nullable=False, default=0)
+    pontos_resgatados = db.Column(db.Integer, nullable=False, default=0)
+    qtd_resgates = db.Column(db.Integer, nullable=False, default=0)
+    atualizado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ResumoPendente(db.Model):
+    # Dias com lançamentos apagados: não deixam rastro em atualizado_em, então
+    # ficam anotados aqui até o próximo consolidar-resumo
+    __tablename__ = 'resumo_pendente_tintas'
+    dia = db.Column(db.Date, primary_key=True)
+    marcado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class Notificacao(db.Model):
+    # Outbox: gravada na mesma transação do evento e enviada depois pelo worker
+    # (flask enviar-notificacoes), nunca dentro da requisição
+    __tablename__ = 'notificacao_tintas'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user_tintas.id", ondelete="CASCADE"), nullable=False, index=True)
+    evento = db.Column(db.String(40), nullable=False)
+    mensagem = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pendente')  # pendente, enviando, enviado, ignorado, falhou
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    ultimo_erro = db.Column(db.String(255), nullable=True)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    enviado_em = db.Column(db.DateTime, nullable=True)
+
+# Fila do worker: pendentes por ordem de próxima tentativa
+db.Index("ix_notificacao_tintas_fila", Notificacao.status, Notificacao.proxima_tentativa)
@@ -0,0 +1,163 @@
+import json
+import smtplib
+import time
+import urllib.request
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from sqlalchemy import and_, func
+
+from models import Notificacao, User, db
+
+
+class NotificacaoIgnorada(Exception):
+    """O canal não alcança o destinatário (ex.: pintor sem e-mail); não há nova tentativa."""
+
+
+class CanalLog:
+    """Apenas registra no terminal; usado em desenvolvimento e testes."""
+
+    def enviar(self, user: User, mensagem: str) -> None:
+        print(f"[notificação] {user.nome} ({user.telefone}): {mensagem}", flush=True)
+
+
+class CanalWebhook:
+    """POST JSON para um gateway de WhatsApp/SMS (telefone + mensagem)."""
+
+    def __init__(self, url: str, token: str | None = None, timeout: float = 10):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def enviar(self, user: User, mensagem: str) -> None:
+        corpo = json.dumps({"telefone": user.telefone, "nome": user.nome, "mensagem": mensagem}).encode("utf-8")
+        requisicao = urllib.request.Request(self.url, data=corpo, method="POST", headers={"Content-Type": "application/json"})
+        if self.token:
+            requisicao.add_header("Authorization", f"Bearer {self.token}")
+        with urllib.request.urlopen(requisicao, timeout=self.timeout) as resposta:
+            if resposta.status >= 300:
+                raise RuntimeError(f"Gateway respondeu HTTP {resposta.status}")
+
+
+class CanalEmail:
+    """E-mail via SMTP; notificações de pintores sem e-mail cadastrado ficam como ignoradas."""
+
+    def __init__(self, host: str, porta: int, usuario: str | None, senha: str | None, remetente: str):
+        self.host = host
+        self.porta = porta
+        self.usuario = usuario
+        self.senha = senha
+        self.remetente = remetente
+
+    def enviar(self, user: User, mensagem: str) -> None:
+        if not user.email:
+            raise NotificacaoIgnorada("Pintor sem e-mail cadastrado")
+        email = EmailMessage()
+        email["Subject"] = "Clube Novo Mundo"
+        email["From"] = self.remetente
+        email["To"] = user.email
+        email.set_content(mensagem)
+        with smtplib.SMTP(self.host, self.porta, timeout=10) as servidor:
+            servidor.starttls()
+            if self.usuario:
+                servidor.login(self.usuario, self.senha or "")
+            servidor.send_message(email)
+
+
+def enfileirar_notificacao(user: User, evento: str, mensagem: str) -> None:
+    """Grava a notificação na sessão atual; ela só existe se o evento for commitado."""
+    db.session.add(Notificacao(user_id=user.id, evento=evento, mensagem=mensagem))
+
+
+def reservar_lote(lote: int, concessao: int, max_tentativas: int) -> list[tuple[int, int, str, User]]:
+    """Marca até `lote` notificações como 'enviando' e devolve (id, tentativa, mensagem, user).
+
+    A reserva é uma transação curta: no Postgres o SKIP LOCKED deixa vários workers
+    dividirem a fila, e os locks acabam no commit, antes de qualquer envio. Se o
+    worker cair, o que ficou em 'enviando' volta à fila quando a concessão vence;
+    como a tentativa é contada na reserva, uma notificação que derruba o worker
+    vira 'falhou' ao esgotar `max_tentativas`, em vez de voltar para sempre.
+    """
+    agora = datetime.utcnow()
+    disponivel = and_(Notificacao.status.in_(('pendente', 'enviando')), Notificacao.proxima_tentativa <= agora)
+    Notificacao.query.filter(disponivel, Notificacao.tentativas >= max_tentativas).update({
+        Notificacao.status: 'falhou',
+        Notificacao.ultimo_erro: func.coalesce(Notificacao.ultimo_erro, 'Envio interrompido (worker caiu)'),
+    }, synchronize_session=False)
+    linhas = (
+        db.session.query(Notificacao, User)
+        .join(User, User.id == Notificacao.user_id)
+        .filter(disponivel, Notificacao.tentativas < max_tentativas)
+        .order_by(Notificacao.proxima_tentativa, Notificacao.id)
+        .limit(lote)
+        .with_for_update(skip_locked=True, of=Notificacao)
+        .all()
+    )
+    reservadas = [(notificacao.id, notificacao.tentativas + 1, notificacao.mensagem, user) for notificacao, user in linhas]
+    if reservadas:
+        Notificacao.query.filter(Notificacao.id.in_([reservada[0] for reservada in reservadas])).update({
+            Notificacao.status: 'enviando',
+            Notificacao.tentativas: Notificacao.tentativas + 1,
+            Notificacao.proxima_tentativa: agora + timedelta(seconds=concessao),
+        }, synchronize_session=False)
+    # Os usuários continuam legíveis depois do commit sem uma nova consulta cada
+    db.session.expunge_all()
+    db.session.commit()
+    return reservadas
+
+
+def processar_lote(canal, lote: int, max_tentativas: int, espera_base: int, concessao: int) -> tuple[int, int, int]:
+    """Envia um lote da fila. Retorna (enviadas, ignoradas, falhas).
+
+    Cada resultado é gravado com seu próprio commit, fora de qualquer lock; falhas
+    voltam para a fila com espera exponencial até `max_tentativas`.
+    """
+    enviadas = ignoradas = falhas = 0
+    for notificacao_id, tentativa, mensagem, user in reservar_lote(lote, concessao, max_tentativas):
+        try:
+            canal.enviar(user, mensagem)
+        except NotificacaoIgnorada as e:
+            ignoradas += 1
+            valores = {Notificacao.status: 'ignorado', Notificacao.ultimo_erro: str(e)[:255]}
+        except Exception as e:
+            falhas += 1
+            valores = {Notificacao.ultimo_erro: str(e)[:255]}
+            if tentativa >= max_tentativas:
+                valores[Notificacao.status] = 'falhou'
+            else:
+                valores[Notificacao.status] = 'pendente'
+                valores[Notificacao.proxima_tentativa] = datetime.utcnow() + timedelta(seconds=espera_base * 2 ** (tentativa - 1))
+        else:
+            enviadas += 1
+            valores = {Notificacao.status: 'enviado', Notificacao.enviado_em: datetime.utcnow()}
+        Notificacao.query.filter_by(id=notificacao_id, status='enviando').update(valores, synchronize_session=False)
+        db.session.commit()
+    return enviadas, ignoradas, falhas
+
+
+def executar_worker(canal, lote: int, continuo: bool, intervalo: float, max_tentativas: int, espera_base: int,
+                    concessao: int, log=print) -> None:
+    inicio = time.monotonic()
+    total_enviadas = total_ignoradas = total_falhas = 0
+    try:
+        while True:
+            inicio_lote = time.monotonic()
+            enviadas, ignoradas, falhas = processar_lote(canal, lote, max_tentativas, espera_base, concessao)
+            total_enviadas += enviadas
+            total_ignoradas += ignoradas
+            total_falhas += falhas
+            if enviadas or ignoradas or falhas:
+                duracao = time.monotonic() - inicio_lote
+                log(f"lote: {enviadas} enviada(s), {ignoradas} ignorada(s), {falhas} falha(s) em {duracao:.2f}s "
+                    f"({enviadas / duracao if duracao else 0:.0f} envios/s)")
+            # Lote cheio: provavelmente há mais na fila, segue sem esperar
+            if enviadas + ignoradas + falhas == lote:
+                continue
+            if not continuo:
+                break
+            time.sleep(intervalo)
+    except KeyboardInterrupt:
+        pass
+    duracao = time.monotonic() - inicio
+    log(f"{total_enviadas} enviada(s), {total_ignoradas} ignorada(s), {total_falhas} falha(s) em {duracao:.2f}s "
+        f"({total_enviadas / duracao if duracao else 0:.0f} envios/s).")
@@ -0,0 +1,153 @@
+import threading
+import time
+
+from flask import before_render_template, g, has_app_context, request, template_rendered
+from flask.templating import Environment
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class Perfil:
+    """Tempos acumulados de uma requisição (ms): SQL, render e cada template/bloco."""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.sql = 0.0
+        self.sql_qtd = 0
+        self.sql_no_render = 0.0
+        self.render = 0.0
+        self.secoes: dict[str, float] = {}
+        self._renders: list[float] = []
+
+    @property
+    def renderizando(self) -> bool:
+        return bool(self._renders)
+
+    def somar(self, secao: str, ms: float) -> None:
+        self.secoes[secao] = self.secoes.get(secao, 0.0) + ms
+
+    @property
+    def total(self) -> float:
+        return (time.perf_counter() - self.inicio) * 1000
+
+    def server_timing(self) -> str:
+        itens = [
+            f"total;dur={self.total:.1f}",
+            f'sql;dur={self.sql:.1f};desc="{self.sql_qtd} consultas"',
+            # Render sem o SQL disparado de dentro do template (relacionamentos lazy)
+            f"render;dur={self.render - self.sql_no_render:.1f}",
+            f"sql-render;dur={self.sql_no_render:.1f}",
+        ]
+        itens += [f"{secao};dur={ms:.1f}" for secao, ms in self.secoes.items()]
+        return ", ".join(itens)
+
+
+def _perfil_atual() -> Perfil | None:
+    return g.get("perfil") if has_app_context() else None
+
+
+def _cronometrar_bloco(nome: str, funcao):
+    def bloco(contexto):
+        perfil = _perfil_atual()
+        if perfil is None:
+            yield from funcao(contexto)
+            return
+        inicio = time.perf_counter()
+        try:
+            yield from funcao(contexto)
+        finally:
+            perfil.somar(f"bloco-{nome}", (time.perf_counter() - inicio) * 1000)
+    return bloco
+
+
+class AmbientePerfilado(Environment):
+    """Ambiente Jinja do Flask que, com o perfil ligado, cronometra cada {% block %}.
+
+    Os blocos são envolvidos quando o template é carregado; com PERFIL_TEMPLATES
+    desligado no carregamento nada muda e o custo é zero.
+    """
+
+    def get_template(self, name, parent=None, globals=None):
+        template = super().get_template(name, parent, globals)
+        if self.app.config.get("PERFIL_TEMPLATES") and not getattr(template, "_perfilado", False):
+            for bloco, funcao in list(template.blocks.items()):
+                template.blocks[bloco] = _cronometrar_bloco(bloco, funcao)
+            template._perfilado = True
+        return template
+
+
+def _antes_sql(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._perfil_inicio = time.perf_counter()
+
+
+def _depois_sql(conn, cursor, statement, parameters, context, executemany):
+    inicio = getattr(context, "_perfil_inicio", None)
+    perfil = _perfil_atual()
+    if inicio is not None and perfil is not None:
+        ms = (time.perf_counter() - inicio) * 1000
+        perfil.sql += ms
+        perfil.sql_qtd += 1
+        if perfil.renderizando:
+            perfil.sql_no_render += ms
+
+
+_trava_sql = threading.Lock()
+
+
+def _ligar_tempo_sql() -> None:
+    """Registra os listeners de SQL (uma vez por processo), só quando o perfil é usado."""
+    with _trava_sql:
+        if not event.contains(Engine, "before_cursor_execute", _antes_sql):
+            event.listen(Engine, "before_cursor_execute", _antes_sql)
+            event.listen(Engine, "after_cursor_execute", _depois_sql)
+
+
+def instalar_perfil(app) -> None:
+    """Liga os ganchos de tempo: SQL, render por template/bloco e o header Server-Timing."""
+    app.jinja_environment = AmbientePerfilado
+
+    @app.before_request
+    def _iniciar_perfil():
+        if app.config.get("PERFIL_TEMPLATES"):
+            _ligar_tempo_sql()
+            g.perfil = Perfil()
+
+    @app.after_request
+    def _registrar_perfil(resposta):
+        perfil = _perfil_atual()
+        if perfil is not None:
+            resposta.headers["Server-Timing"] = perfil.server_timing()
+            limite = app.config.get("PERFIL_LOG_MS")
+            if limite is not None and perfil.total >= limite:
+                print(f"[perfil] {request.method} {request.path} {resposta.headers['Server-Timing']}", flush=True)
+        return resposta
+
+    def _antes_render(sender, template, context, **extra):
+        perfil = _perfil_atual()
+        if perfil is not None:
+            perfil._renders.append(time.perf_counter())
+
+    def _depois_render(sender, template, context, **extra):
+        perfil = _perfil_atual()
+        if perfil is not None and perfil._renders:
+            ms = (time.perf_counter() - perfil._renders.pop()) * 1000
+            perfil.render += ms
+            perfil.somar(f"tpl-{template.name}", ms)
+
+    before_render_template.connect(_antes_render, app, weak=False)
+    template_rendered.connect(_depois_render, app, weak=False)
+
+
+def ler_server_timing(valor: str) -> tuple[dict[str, float], dict[str, str]]:
+    """Converte o header Server-Timing em ({nome: ms}, {nome: desc}) (usado pelo benchmark)."""
+    tempos, descricoes = {}, {}
+    for item in valor.split(","):
+        nome, *parametros = [parte.strip() for parte in item.split(";")]
+        for parametro in parametros:
+            chave, _, conteudo = parametro.partition("=")
+            if chave == "dur":
+                tempos[nome] = float(conteudo)
+            elif chave == "desc":
+                descricoes[nome] = conteudo.strip('"')
+    return tempos, descricoes